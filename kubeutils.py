@@ -14,6 +14,7 @@ import re
 import platform
 import hashlib
 from .utils import CustomLogger
+from .s3region import NAUTILUS_S3_MAP
 
 
 with open("config/kube.yaml", "r") as f:
@@ -401,16 +402,9 @@ def update_env(env):
     if "CUDA_VISIBLE_DEVICES" in env:
         del env["CUDA_VISIBLE_DEVICES"]  # Always use all GPUs in the cluster
     # Map the S3 endpoint to the internal endpoint
-    nautilus_s3_map = {
-        'https://s3-west.nrp-nautilus.io': 'http://rook-ceph-rgw-nautiluss3.rook',
-        'https://s3-central.nrp-nautilus.io': 'http://rook-ceph-rgw-centrals3.rook-central',
-        'https://s3-east.nrp-nautilus.io': 'http://rook-ceph-rgw-easts3.rook-east',
-        'https://s3-haosu.nrp-nautilus.io': 'http://rook-ceph-rgw-haosu.rook-haosu',
-        'https://s3-tide.nrp-nautilus.io': 'http://rook-ceph-rgw-tide.rook-tide'
-    }
     for env_key in env:
-        if env[env_key] in nautilus_s3_map:
-            env[env_key] = nautilus_s3_map[env[env_key]]
+        if env[env_key] in NAUTILUS_S3_MAP:
+            env[env_key] = NAUTILUS_S3_MAP[env[env_key]]
 
     env = [{'name': k, 'value': v} for k, v in env.items()]
     return env
@@ -497,7 +491,7 @@ git pull
 git submodule update --init --recursive
 echo "conda activate {conda_env_name}; " >> ~/.bashrc
 export PATH="{conda_env_path}/bin/:$PATH"
-echo 'if [ -f "$HOME/src/toolbox/s3region.sh" ]; then source "$HOME/src/tool outbox/s3region.sh"; fi' >> ~/.bashrc
+echo 'if [ -f "$HOME/src/toolbox/s3region.sh" ]; then source "$HOME/src/toolbox/s3region.sh"; fi' >> ~/.bashrc
 if [ -f src/toolbox/s3region.sh ]; then
     chmod +x src/toolbox/s3region.sh
     source src/toolbox/s3region.sh
@@ -0,0 +1,173 @@
+import os
+import json
+import socket
+import time
+from functools import lru_cache
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from toolbox.utils import CustomLogger
+
+
+NODEINFO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nodeinfo.json')
+S3_PROBE_ENDPOINTS = os.getenv('S3_PROBE_ENDPOINTS', 'false').lower() in ('1', 'true', 'yes')
+S3_PROBE_TIMEOUT = float(os.getenv('S3_PROBE_TIMEOUT', 1))  # Seconds per connection attempt
+# Suffix of the regional variables, e.g. S3_ENDPOINT_URL_WEST, for each region in nodeinfo.json
+REGION_SUFFIXES = {
+    'us-west': 'WEST',
+    'us-central': 'CENTRAL',
+    'us-east': 'EAST',
+}
+# Regions without their own gateway use the nearest one
+NEAREST_REGIONS = {
+    'pacific': 'us-west',
+    'us-mountain': 'us-central',
+    'eu': 'us-east',
+}
+# External endpoints and the in-cluster endpoints that serve the same buckets
+NAUTILUS_S3_MAP = {
+    'https://s3-west.nrp-nautilus.io': 'http://rook-ceph-rgw-nautiluss3.rook',
+    'https://s3-central.nrp-nautilus.io': 'http://rook-ceph-rgw-centrals3.rook-central',
+    'https://s3-east.nrp-nautilus.io': 'http://rook-ceph-rgw-easts3.rook-east',
+    'https://s3-haosu.nrp-nautilus.io': 'http://rook-ceph-rgw-haosu.rook-haosu',
+    'https://s3-tide.nrp-nautilus.io': 'http://rook-ceph-rgw-tide.rook-tide'
+}
+logger = CustomLogger()
+
+
+@lru_cache(maxsize=None)
+def load_nodeinfo(path=NODEINFO_PATH):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.debug(f"Cannot read {path}: {e}")
+        return {}
+
+
+def node_region(node_name=None):
+    """
+    Region of a node in nodeinfo.json, default to the node this pod runs on ($NODE_NAME).
+    """
+    node_name = node_name or os.getenv('NODE_NAME')
+    if not node_name:
+        return None
+    return load_nodeinfo().get(node_name, {}).get('region')
+
+
+def regional_settings(suffix):
+    """
+    Endpoint and credentials from S3_ENDPOINT_URL_<suffix>, AWS_ACCESS_KEY_ID_<suffix> and AWS_SECRET_ACCESS_KEY_<suffix>,
+    or None if any of them is missing.
+    """
+    settings = {
+        'endpoint_url': os.getenv(f'S3_ENDPOINT_URL_{suffix}'),
+        'aws_access_key_id': os.getenv(f'AWS_ACCESS_KEY_ID_{suffix}'),
+        'aws_secret_access_key': os.getenv(f'AWS_SECRET_ACCESS_KEY_{suffix}'),
+    }
+    return settings if all(settings.values()) else None
+
+
+def default_settings():
+    if not os.getenv('S3_ENDPOINT_URL'):
+        return None
+    return {
+        'endpoint_url': os.getenv('S3_ENDPOINT_URL'),
+        'aws_access_key_id': os.getenv('AWS_ACCESS_KEY_ID'),
+        'aws_secret_access_key': os.getenv('AWS_SECRET_ACCESS_KEY'),
+    }
+
+
+def candidate_settings(region=None):
+    """
+    Configured endpoints, nearest first: the gateway of the node's region, the other regional gateways,
+    then S3_ENDPOINT_URL. Inside the cluster, each external Nautilus endpoint is preceded by its internal one.
+    """
+    region = NEAREST_REGIONS.get(region, region)
+    suffixes = sorted(REGION_SUFFIXES.items(), key=lambda item: item[0] != region)
+    candidates = [regional_settings(suffix) for _, suffix in suffixes] + [default_settings()]
+    in_cluster = bool(os.getenv('KUBERNETES_SERVICE_HOST'))
+    seen = set()
+    results = []
+    for settings in candidates:
+        if settings is None:
+            continue
+        endpoint_urls = [settings['endpoint_url']]
+        if in_cluster and settings['endpoint_url'] in NAUTILUS_S3_MAP:
+            endpoint_urls.insert(0, NAUTILUS_S3_MAP[settings['endpoint_url']])
+        for endpoint_url in endpoint_urls:
+            if endpoint_url not in seen:
+                seen.add(endpoint_url)
+                results.append({**settings, 'endpoint_url': endpoint_url})
+    return results
+
+
+def probe_latency(endpoint_url, attempts=3, timeout=S3_PROBE_TIMEOUT):
+    """
+    Fastest TCP connection time to an endpoint in seconds, inf if it cannot be reached.
+    """
+    url = urlparse(endpoint_url)
+    port = url.port or (443 if url.scheme == 'https' else 80)
+    latency = float('inf')
+    for _ in range(attempts):
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((url.hostname, port), timeout=timeout):
+                latency = min(latency, time.perf_counter() - start)
+        except OSError:
+            break
+    return latency
+
+
+@lru_cache(maxsize=None)
+def resolve_endpoint(node_name=None, probe=S3_PROBE_ENDPOINTS):
+    """
+    Endpoint and credentials to use on this node. Without probing, take the gateway of the node's region
+    if its variables are set, as s3region.sh did. With probing, connect to every candidate and take the fastest.
+    The result is cached for the lifetime of the process.
+
+    :param node_name: Node to resolve for, default to $NODE_NAME
+    :param probe: Measure the latency to the candidate endpoints
+    :return: Dict with endpoint_url, aws_access_key_id and aws_secret_access_key, or None if nothing is configured
+    """
+    region = node_region(node_name)
+    candidates = candidate_settings(region)
+    if not candidates:
+        return None
+    if probe and len(candidates) > 1:
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            latencies = list(executor.map(lambda settings: probe_latency(settings['endpoint_url']), candidates))
+        for settings, latency in zip(candidates, latencies):
+            logger.debug(f"{settings['endpoint_url']}: {latency * 1000:.1f}ms")
+        if min(latencies) < float('inf'):
+            return candidates[latencies.index(min(latencies))]
+        logger.warning("No S3 endpoint could be reached, using the nearest one.")
+    suffix = REGION_SUFFIXES.get(NEAREST_REGIONS.get(region, region))
+    if suffix and regional_settings(suffix):
+        return regional_settings(suffix)
+    return default_settings()
+
+
+def endpoint_env(node_name=None, probe=S3_PROBE_ENDPOINTS):
+    """
+    Resolved endpoint as the environment variables read by boto3 and s5cmd.
+    """
+    settings = resolve_endpoint(node_name, probe)
+    if settings is None:
+        return {}
+    env = {'S3_ENDPOINT_URL': settings['endpoint_url']}
+    if settings['aws_access_key_id'] and settings['aws_secret_access_key']:
+        env['AWS_ACCESS_KEY_ID'] = settings['aws_access_key_id']
+        env['AWS_SECRET_ACCESS_KEY'] = settings['aws_secret_access_key']
+    return env
+
+
+if __name__ == "__main__":
+    import argparse
+    import shlex
+
+    parser = argparse.ArgumentParser(description="Print the S3 endpoint of this node as shell exports.")
+    parser.add_argument("--node", type=str, default=None, help="Node name, default to $NODE_NAME")
+    parser.add_argument("--probe", action="store_true", default=S3_PROBE_ENDPOINTS, help="Pick the endpoint with the lowest latency")
+    args = parser.parse_args()
+    for key, value in endpoint_env(args.node, args.probe).items():
+        print(f"export {key}={shlex.quote(value)}")
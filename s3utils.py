@@ -1,29 +1,65 @@
 import os
 import glob
-import boto3
 import fnmatch
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, BotoCoreError
 from botocore import UNSIGNED
-from botocore.client import Config
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 import shutil
 import sys
 from toolbox.utils import CustomLogger, acquire_lock, release_lock
+from toolbox.s3region import resolve_endpoint, endpoint_env
 import time
-from http.server import SimpleHTTPRequestHandler, HTTPServer
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 import json
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
 from pathlib import Path
 import re
 import socket
-import requests
+import socketserver
+import http.client
 import threading
+import hashlib
+import sqlite3
+import subprocess
+import tempfile
+from collections import Counter, OrderedDict, deque
+import random
+import itertools
+import io
+import mmap
+import ctypes
+import fcntl
+import ctypes.util
+import select
+import struct
+import uuid
 
 
 S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
 API_SERVER_PORT = 57575
-if not S3_ENDPOINT_URL or not S3_BUCKET_NAME:
-    raise EnvironmentError("Please set the S3_ENDPOINT_URL and S3_BUCKET_NAME environment variables.")
+API_SERVER_SOCKET = os.getenv('API_SERVER_SOCKET')  # Unix socket path for the API server, instead of the TCP port
+S3_MAX_WORKERS = int(os.getenv('S3_MAX_WORKERS', 16))  # Files transferred concurrently
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', 4))  # Parts transferred concurrently per file
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+S5CMD_NUMWORKERS = int(os.getenv('S5CMD_NUMWORKERS', 256))
+S3_DELETE_BATCH_SIZE = 1000  # DeleteObjects limit
+S3_RETRYABLE_ERRORS = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'InternalError', 'ServiceUnavailable', '503'}
+S3_TELEMETRY_LOG = os.getenv('S3_TELEMETRY_LOG', os.path.expanduser('~/.cache/toolbox/transfer.jsonl'))  # Empty to disable
+API_CACHE_TTL = float(os.getenv('API_CACHE_TTL', 30))  # Seconds the API server caches find / list results
+API_CACHE_SIZE = int(os.getenv('API_CACHE_SIZE', 1024))
+S3_LISTING_CACHE = os.getenv('S3_LISTING_CACHE', os.path.expanduser('~/.cache/toolbox/s3_listing.db'))
+S3_LISTING_CACHE_TTL = float(os.getenv('S3_LISTING_CACHE_TTL', 60))  # Seconds, 0 to disable
+S3_PART_SUFFIX = '.s3part'  # Downloads are written to <file>.s3part and renamed when complete
+S3_UPLOAD_JOURNAL_DIR = os.getenv('S3_UPLOAD_JOURNAL_DIR', os.path.expanduser('~/.cache/toolbox/uploads'))
+S3_UPLOAD_JOURNAL_MAX_AGE = float(os.getenv('S3_UPLOAD_JOURNAL_MAX_AGE', 7 * 24 * 3600))  # Seconds before an unfinished upload is aborted
+S3_CACHE_DIR = os.getenv('S3_CACHE_DIR')  # Node-level cache of downloaded objects shared by projects, unset to disable
+S3_CACHE_MAX_BYTES = int(os.getenv('S3_CACHE_MAX_BYTES', 0))  # 0 for unbounded
+S3_READ_BLOCK_SIZE = int(os.getenv('S3_READ_BLOCK_SIZE', 8 * 1024 * 1024))  # Size of the ranged reads of S3File
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 0))  # 0 to size the pool for the transfer engine
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', 5))  # Including the first attempt
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', 10))  # Seconds
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', 60))  # Seconds
 logger = CustomLogger()
 
 
@@ -34,66 +70,557 @@ def use_s5cmd():
     return shutil.which('s5cmd')
 
 
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class APIClient():
+    """
+    Client for the local API server. Each thread keeps one persistent HTTP/1.1 connection,
+    so repeated requests do not pay for a new connection.
+    
+    :param port: TCP port of the server.
+    :param socket_path: Unix socket of the server; takes precedence over the port.
+    """
+    headers = {'Content-type': 'application/json'}
+
+    def __init__(self, port=API_SERVER_PORT, socket_path=None):
+        self.port = port
+        self.socket_path = socket_path
+        self.local = threading.local()
+
+    def connect(self):
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path)
+        return http.client.HTTPConnection('localhost', self.port)
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def online(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None and conn.sock is not None:
+            # An idle keep-alive connection is only readable once the server has closed it
+            if not select.select([conn.sock], [], [], 0)[0]:
+                return True
+            self.close()
+        if self.socket_path:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                return s.connect_ex(self.socket_path) == 0
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            return s.connect_ex(('localhost', self.port)) == 0
+
+    def request(self, command, path, **options):
+        body = json.dumps({'command': command, 'path': relative_path(path), **options}).encode('utf-8')
+        conn = getattr(self.local, 'conn', None)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self.local.conn = self.connect()
+            try:
+                conn.request('POST', '/', body, self.headers)
+                response = conn.getresponse()
+                return json.loads(response.read())
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection, retry once on a new one
+                conn, reused = None, False
+
+
+def relative_path(path):
+    """
+    Path relative to the working directory, as the API server expects.
+    """
+    path = os.fspath(path)
+    if not os.path.isabs(path):
+        path = os.path.normpath(path)
+        if not path.startswith('..'):
+            return path
+    cwd = os.getcwd()
+    path = os.path.relpath(os.path.realpath(path), cwd)
+    if path == '..' or path.startswith('..' + os.sep):
+        raise ValueError(f"{path} is not in the current directory {cwd}")
+    return path
+
+
+api_clients = {}
+
+
+def reset_api_clients():
+    """
+    Drop the connections of the API clients, so that a forked process, e.g. a DataLoader worker, opens its own
+    instead of sending requests on the parent's.
+    """
+    for client in api_clients.values():
+        client.local = threading.local()
+
+
+os.register_at_fork(after_in_child=reset_api_clients)
+
+
+def get_api_client(port=API_SERVER_PORT):
+    client = api_clients.get(port)
+    if client is None:
+        client = api_clients[port] = APIClient(port, API_SERVER_SOCKET if port == API_SERVER_PORT else None)
+    return client
+
+
 def api_server_online(port=API_SERVER_PORT):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('localhost', port)) == 0
+    return get_api_client(port).online()
     
 
-def send_request(command, path, port=API_SERVER_PORT):
-    # Assert relative path
-    if type(path) is str:
-        path = Path(path)
-    path = path.resolve().relative_to(Path.cwd())
-        
-    url = f'http://localhost:{port}'
-    headers = {'Content-type': 'application/json'}
-    payload = {'command': command, 'path': str(path)}
+def send_request(command, path, port=API_SERVER_PORT, **options):
+    return get_api_client(port).request(command, path, **options)
 
-    # Sending POST request
-    response = requests.post(url, headers=headers, json=payload)
-    return response.json()
 
+def check_s3_env():
+    if not S3_BUCKET_NAME or not (S3_ENDPOINT_URL or resolve_endpoint()):
+        raise EnvironmentError("Please set the S3_ENDPOINT_URL and S3_BUCKET_NAME environment variables.")
 
-# Check if credentials are provided
-if os.getenv('AWS_ACCESS_KEY_ID') and os.getenv('AWS_SECRET_ACCESS_KEY'):
-    # Credentials are provided, use them to create the client
-    s3_client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
-else:
-    # Credentials are not provided, use anonymous access
-    s3_client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL, config=Config(signature_version=UNSIGNED))
+
+def s3_endpoint_url():
+    """
+    Endpoint the client connects to: the one resolved for this node, or S3_ENDPOINT_URL.
+    """
+    endpoint = resolve_endpoint()
+    return endpoint['endpoint_url'] if endpoint else S3_ENDPOINT_URL
 
 
-def run_s5cmd_and_log(s5cmd_command, log_file_path="download.log"):
-    tail = (
-        r""" 2>&1 | awk 'BEGIN{RS=" "; ORS=""} {print $0 (/\\n/ ? "" : " "); if(tolower($0) ~ /%/) print "\\n"}' | tee -a """
-        + log_file_path
+def create_s3_client():
+    """
+    Create a boto3 client whose connection pool is large enough for the transfer engine.
+    """
+    # boto3 takes a few hundred ms to import, only pay for it when S3 is used
+    import boto3
+    from botocore.config import Config
+
+    check_s3_env()
+    config = Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS or max(10, S3_MAX_WORKERS * S3_MAX_CONCURRENCY),
+        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'standard'},
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
     )
+    # Regional endpoint and credentials of this node, see s3region.py
+    endpoint = resolve_endpoint()
+    endpoint_url = s3_endpoint_url()
+    credentials = {}
+    if endpoint and endpoint['aws_access_key_id'] and endpoint['aws_secret_access_key']:
+        credentials = {key: endpoint[key] for key in ('aws_access_key_id', 'aws_secret_access_key')}
+    logger.debug(f"Using S3 endpoint {endpoint_url}")
+    # Check if credentials are provided
+    if credentials or (os.getenv('AWS_ACCESS_KEY_ID') and os.getenv('AWS_SECRET_ACCESS_KEY')):
+        # Credentials are provided, use them to create the client
+        client = boto3.client('s3', endpoint_url=endpoint_url, config=config, **credentials)
+    else:
+        # Credentials are not provided, use anonymous access
+        client = boto3.client('s3', endpoint_url=endpoint_url, config=config.merge(Config(signature_version=UNSIGNED)))
+    # Count API calls and HTTP attempts, the difference is the number of retries
+    client.meta.events.register('before-call.s3', count_request)
+    client.meta.events.register('before-send.s3', count_request)
+    return client
 
-    s5cmd_command = re.sub(
-        r'(\s*(?:&&|&|;)\s*)', 
-        tail + r'\1',
-        s5cmd_command
-    ) + tail
-    logger.debug(s5cmd_command)
-    os.system(s5cmd_command)
 
+request_counts = Counter()
+request_counts_lock = threading.Lock()
 
-def run_s5cmd_interactive(s5cmd_command):
-    logger.debug(s5cmd_command)
-    os.system(s5cmd_command)
 
+def count_request(event_name, **kwargs):
+    with request_counts_lock:
+        request_counts[event_name.split('.')[0]] += 1
 
-def run_s5cmd(s5cmd_command, log_file_path="download.log"):
-    logger.debug(s5cmd_command)
-    if sys.stdin.isatty():
-        run_s5cmd_interactive(s5cmd_command)
-    else:
-        run_s5cmd_and_log(s5cmd_command, log_file_path)
 
+def count_retries():
+    with request_counts_lock:
+        return request_counts['before-send'] - request_counts['before-call']
 
-def get_local_files(s3_path, local_path):
+
+s3_client_state = (None, None)  # (PID, client)
+s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
     """
-    Recursively get local files that match the s3_path pattern in the local_path directory.
+    boto3 client of the current process, created on first use.
+    A forked process, e.g. a DataLoader worker, creates its own instead of sharing the parent's connection pool.
+    """
+    global s3_client_state
+    pid, client = s3_client_state
+    if pid != os.getpid():
+        with s3_client_lock:
+            pid, client = s3_client_state
+            if pid != os.getpid():
+                client = create_s3_client()
+                s3_client_state = (os.getpid(), client)
+    return client
+
+
+def reset_s3_client():
+    """
+    Drop the current client, so that the next get_s3_client() creates one with the current settings.
+    """
+    global s3_client_state, s3_client_lock
+    s3_client_state = (None, None)
+    s3_client_lock = threading.Lock()  # Another thread may have held it when the process forked
+
+
+os.register_at_fork(after_in_child=reset_s3_client)
+
+
+def __getattr__(name):
+    # s3_client used to be created at import
+    if name == 's3_client':
+        return get_s3_client()
+    if name == 'S3Dataset':
+        # Built on first use, so that importing s3utils does not import torch
+        try:
+            from torch.utils.data import IterableDataset
+            bases = (S3Stream, IterableDataset)
+        except ImportError:
+            bases = (S3Stream,)
+        dataset_class = type('S3Dataset', bases, {'__module__': __name__, '__doc__': S3Stream.__doc__})
+        globals()['S3Dataset'] = dataset_class
+        return dataset_class
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class TransferStats():
+    """
+    Telemetry shared by the boto3 and s5cmd backends: bytes, objects, throughput, ETA, retries and latency percentiles.
+    A summary is logged and appended as one JSON line to S3_TELEMETRY_LOG when the transfer finishes.
+    """
+    progress_interval = 10  # Seconds between progress logs
+
+    def __init__(self, operation, backend, workers=None, total_bytes=None):
+        self.operation = operation
+        self.backend = backend
+        self.workers = workers
+        self.total_bytes = total_bytes
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.retries_at_start = count_retries()
+        self.records = []
+        self.failures = 0
+        self.bytes_done = 0  # Including bytes of files still in flight
+        self.last_progress = self.start
+
+    def progress(self, num_bytes):
+        """
+        Count bytes as they are transferred, and log the throughput and ETA every progress_interval seconds.
+        """
+        with self.lock:
+            self.bytes_done += num_bytes
+            now = time.time()
+            if now - self.last_progress < self.progress_interval:
+                return
+            self.last_progress = now
+            bytes_done = self.bytes_done
+        rate = bytes_done / max(now - self.start, 1e-6)
+        message = f"{self.operation.capitalize()}: {format_size(bytes_done)}, {format_size(rate)}/s"
+        if self.total_bytes:
+            eta = max(self.total_bytes - bytes_done, 0) / max(rate, 1e-6)
+            message += f", {bytes_done / self.total_bytes:.1%} of {format_size(self.total_bytes)}, ETA {eta:.0f}s"
+        logger.info(message)
+
+    def record(self, key, num_bytes, seconds=None, progressed=False):
+        """
+        Record one finished object. num_bytes is None for failures, seconds is None when the backend does not time objects.
+        """
+        with self.lock:
+            if num_bytes is None:
+                self.failures += 1
+                return
+            self.records.append((key, num_bytes, seconds))
+        if not progressed:
+            self.progress(num_bytes)
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        num_bytes = sum(record[1] for record in self.records)
+        timed = sorted((record for record in self.records if record[2] is not None), key=lambda record: record[2])
+        latencies = [record[2] for record in timed]
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+
+        return {
+            'time': self.start,
+            'operation': self.operation,
+            'backend': self.backend,
+            'endpoint': s3_endpoint_url(),
+            'bucket': S3_BUCKET_NAME,
+            'workers': self.workers,
+            'objects': len(self.records),
+            'failures': self.failures,
+            'bytes': num_bytes,
+            'seconds': elapsed,
+            'bytes_per_second': num_bytes / max(elapsed, 1e-6),
+            'retries': count_retries() - self.retries_at_start,
+            'latency_p50': percentile(0.5),
+            'latency_p90': percentile(0.9),
+            'latency_p99': percentile(0.99),
+            'latency_max': latencies[-1] if latencies else None,
+            'slowest': [{'key': key, 'bytes': size, 'seconds': seconds} for key, size, seconds in timed[-5:][::-1]],
+        }
+
+    def finish(self):
+        """
+        Log the summary and append it to S3_TELEMETRY_LOG.
+        """
+        summary = self.summary()
+        if summary['objects'] or summary['failures']:
+            message = (
+                f"{self.operation.capitalize()} finished: {summary['objects']} files ({format_size(summary['bytes'])}) "
+                f"in {summary['seconds']:.2f}s with {self.backend}, {format_size(summary['bytes_per_second'])}/s"
+            )
+            if summary['failures']:
+                message += f", {summary['failures']} failed"
+            if summary['retries']:
+                message += f", {summary['retries']} retries"
+            if summary['latency_p50'] is not None:
+                message += (
+                    f", latency p50 {summary['latency_p50']:.2f}s p90 {summary['latency_p90']:.2f}s "
+                    f"p99 {summary['latency_p99']:.2f}s"
+                )
+            logger.info(message)
+            if S3_TELEMETRY_LOG:
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(S3_TELEMETRY_LOG)), exist_ok=True)
+                    with open(S3_TELEMETRY_LOG, 'a') as f:
+                        f.write(json.dumps(summary) + '\n')
+                except OSError as e:
+                    logger.debug(f"Failed to write telemetry to {S3_TELEMETRY_LOG}: {e}")
+        return summary
+
+
+def run_s5cmd_batch(commands, numworkers=None, log_file_path="download.log", operation='transfer', total_bytes=None):
+    """
+    Run many s5cmd commands from one command file with a single `s5cmd run`, so they share its worker pool.
+
+    :param commands: List of s5cmd commands without the leading "s5cmd", e.g. 'cp -n "src" "dst"'
+    :param numworkers: Size of s5cmd's worker pool, default to S5CMD_NUMWORKERS
+    :param operation: 'download' or 'upload', for the telemetry
+    :param total_bytes: Expected number of bytes, to estimate the remaining time
+    :return: Tuple of (succeeded, failed) lists of s5cmd's JSON results
+    """
+    check_s3_env()
+    with tempfile.NamedTemporaryFile('w', prefix='s5cmd-', suffix='.txt', delete=False) as f:
+        f.write('\n'.join(commands) + '\n')
+        command_file = f.name
+
+    numworkers = numworkers or S5CMD_NUMWORKERS
+    s5cmd_command = ['s5cmd', '--json', '--numworkers', str(numworkers), 'run', command_file]
+    logger.debug(f"{' '.join(s5cmd_command)} ({len(commands)} commands)")
+    stats = TransferStats(operation, 's5cmd', numworkers, total_bytes)
+    if sys.stderr.isatty():
+        # s5cmd prints no progress with --json, log it every second instead
+        stats.progress_interval = 1
+    succeeded, failed = [], []
+    try:
+        with open(log_file_path, 'a') as log_file:
+            process = subprocess.Popen(
+                s5cmd_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env={**os.environ, **endpoint_env()}
+            )
+            for line in process.stdout:
+                log_file.write(line)
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.debug(line.rstrip())
+                    continue
+                if result.get('success'):
+                    logger.info(f"{result.get('operation')} {result.get('source')} {result.get('destination')}")
+                    stats.record(result.get('source'), result.get('object', {}).get('size', 0))
+                    succeeded.append(result)
+                else:
+                    logger.error(f"{result.get('command', result.get('operation'))}: {result.get('error')}")
+                    stats.record(result.get('command'), None)
+                    failed.append(result)
+            process.wait()
+    finally:
+        os.remove(command_file)
+        stats.finish()
+    return succeeded, failed
+
+
+def get_transfer_config():
+    """
+    Multipart settings used by every boto3 upload and download.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=S3_MULTIPART_CHUNKSIZE,
+        multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=S3_MAX_CONCURRENCY,
+        use_threads=S3_MAX_CONCURRENCY > 1,
+    )
+
+
+def format_size(num_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def run_transfers(jobs, transfer, workers=None, operation='transfer', total_bytes=None, verify=None):
+    """
+    Run transfer jobs on a bounded thread pool and report the telemetry.
+
+    :param jobs: Iterable of argument tuples, consumed lazily
+    :param transfer: Callable that performs one job and returns the number of bytes moved, or None on failure.
+                     It receives a `callback` keyword to report bytes as they are transferred
+    :param workers: Number of concurrent transfers, default to S3_MAX_WORKERS
+    :param operation: 'download' or 'upload', for the telemetry
+    :param total_bytes: Expected number of bytes, to estimate the remaining time
+    :param verify: Callable that checks a finished job, called with the job's arguments.
+                   A job that fails the check is retried once, in the same worker
+    :return: List of jobs that succeeded
+    """
+    workers = workers or S3_MAX_WORKERS
+    stats = TransferStats(operation, 'boto3', workers, total_bytes)
+    succeeded = []
+
+    def timed_transfer(*job):
+        start = time.perf_counter()
+        num_bytes = transfer(*job, callback=stats.progress)
+        if num_bytes is not None and verify is not None and not verify(*job):
+            logger.warning(f"{job[0]} failed verification, retrying")
+            num_bytes = transfer(*job, callback=stats.progress)
+            if num_bytes is not None and not verify(*job):
+                logger.error(f"{job[0]} failed verification again")
+                num_bytes = None
+        stats.record(job[0], num_bytes, time.perf_counter() - start, progressed=True)
+        return num_bytes
+
+    def collect(futures):
+        for future in futures:
+            job = pending.pop(future)
+            try:
+                num_bytes = future.result()
+            except Exception as e:
+                logger.error(f"Failed to {operation} {job[0]}: {e}")
+                stats.record(job[0], None)
+                continue
+            if num_bytes is not None:
+                succeeded.append(job)
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for job in jobs:
+            # Keep at most two jobs queued per worker so that huge job lists are not materialized
+            if len(pending) >= workers * 2:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending[executor.submit(timed_transfer, *job)] = job
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+
+    stats.finish()
+    return succeeded
+
+
+class ListingCache():
+    """
+    On-disk cache of S3 listings keyed by endpoint, bucket, prefix and delimiter.
+    Entries keep the size, ETag and LastModified of every object, expire after the TTL,
+    and are invalidated by uploads and removals made through this module.
+    """
+    max_objects = 100000
+
+    def __init__(self, path=S3_LISTING_CACHE, ttl=S3_LISTING_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.initialized = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "endpoint TEXT, bucket TEXT, prefix TEXT, delimiter TEXT, created REAL, data TEXT, "
+                "PRIMARY KEY (endpoint, bucket, prefix, delimiter))"
+            )
+            self.initialized = True
+        return connection
+
+    def enabled(self):
+        if self.ttl <= 0:
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            return True
+        except OSError:
+            return False
+
+    def get(self, prefix, delimiter=''):
+        if not self.enabled():
+            return None
+        try:
+            with self.connect() as connection:
+                row = connection.execute(
+                    "SELECT created, data FROM listings WHERE endpoint=? AND bucket=? AND prefix=? AND delimiter=?",
+                    (s3_endpoint_url(), S3_BUCKET_NAME, prefix, delimiter)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.debug(f"Listing cache unavailable: {e}")
+            return None
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        logger.debug(f"Listing cache hit for {prefix}")
+        return json.loads(row[1])
+
+    def put(self, prefix, delimiter, listing):
+        if not self.enabled():
+            return
+        try:
+            with self.connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?)",
+                    (s3_endpoint_url(), S3_BUCKET_NAME, prefix, delimiter, time.time(), json.dumps(listing))
+                )
+        except sqlite3.Error as e:
+            logger.debug(f"Listing cache unavailable: {e}")
+
+    def invalidate(self, keys):
+        """
+        Drop every cached listing whose prefix covers one of the keys.
+        """
+        if not self.enabled() or not os.path.exists(self.path):
+            return
+        endpoint_url = s3_endpoint_url()
+        try:
+            with self.connect() as connection:
+                connection.executemany(
+                    "DELETE FROM listings WHERE endpoint=? AND bucket=? AND substr(?, 1, length(prefix)) = prefix",
+                    [(endpoint_url, S3_BUCKET_NAME, key) for key in keys]
+                )
+        except sqlite3.Error as e:
+            logger.debug(f"Listing cache unavailable: {e}")
+
+
+listing_cache = ListingCache()
+
+
+def split_local_pattern(s3_path):
+    """
+    Split an s3_path pattern into the local directory to search and the pattern its relative paths must match.
     """
     wildcard_index = s3_path.find('*')
     if wildcard_index == -1:
@@ -107,7 +634,80 @@ def get_local_files(s3_path, local_path):
         else:
             prefix = '.'
             pattern = s3_path
-        
+    return prefix, pattern
+
+
+def iter_local_files(s3_path, local_path, with_stat=False):
+    """
+    Lazily yield the local files that match the s3_path pattern in the local_path directory, in a single os.scandir walk.
+    Directories that cannot contain a match are not entered, and hidden files and directories are skipped, as glob does.
+
+    :param with_stat: Yield (path, stat_result) tuples with the stat of the walk's DirEntry
+    """
+    prefix, pattern = split_local_pattern(s3_path)
+    prefix = os.path.normpath(os.path.join(local_path, prefix))
+    if glob.has_magic(prefix):
+        # Wildcards before the last '/' are expanded by glob, rare enough to leave to it
+        files = get_local_files_glob(s3_path, local_path)
+        yield from ((file, os.stat(file)) for file in files) if with_stat else files
+        return
+    # '*' also matches '/' in fnmatch, so a pattern can only prune directories outside its literal prefix
+    match = None if pattern == '*' else re.compile(fnmatch.translate(pattern)).match
+    literal = re.split(r'[*?\[]', pattern, maxsplit=1)[0]
+
+    def walk(path, rel, literal=literal):
+        try:
+            entries = list(os.scandir(path or '.'))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            entry_path = f"{path}/{entry.name}" if path else entry.name
+            entry_rel = rel + entry.name
+            if entry.is_dir():
+                sub_rel = entry_rel + '/'
+                if sub_rel.startswith(literal) or literal.startswith(sub_rel):
+                    yield from walk(entry_path, sub_rel, literal)
+            elif match is None or match(entry_rel):
+                yield (entry_path, entry.stat()) if with_stat else entry_path
+
+    if os.path.isdir(prefix):
+        yield from walk('' if prefix == '.' else prefix, '')
+        return
+
+    # The prefix is a partial name, as in S3: take the entries of its directory that start with it
+    parent, base = os.path.split(prefix)
+    try:
+        entries = list(os.scandir(parent or '.'))
+    except OSError:
+        return
+    for entry in entries:
+        if not entry.name.startswith(base) or (entry.name.startswith('.') and not base.startswith('.')):
+            continue
+        entry_path = os.path.join(parent, entry.name)
+        if entry.is_dir():
+            candidates = walk(entry_path, '', '')  # Matched against paths relative to the prefix, so nothing to prune
+        else:
+            candidates = [(entry_path, entry.stat()) if with_stat else entry_path]
+        for candidate in candidates:
+            path = candidate[0] if with_stat else candidate
+            if match is None or match(os.path.relpath(path, prefix)):
+                yield candidate
+
+
+def get_local_files(s3_path, local_path):
+    """
+    Recursively get local files that match the s3_path pattern in the local_path directory.
+    """
+    return list(iter_local_files(s3_path, local_path))
+
+
+def get_local_files_glob(s3_path, local_path):
+    """
+    Former glob-based get_local_files, kept as the baseline of benchmark_get_local_files.
+    """
+    prefix, pattern = split_local_pattern(s3_path)
     prefix = os.path.normpath(os.path.join(local_path, prefix))
     if os.path.isdir(prefix):
         local_files = glob.glob(prefix + "/**", recursive=True)
@@ -129,180 +729,1219 @@ def get_local_files(s3_path, local_path):
     return filtered_local_files
 
 
-def get_s3_objects(s3_path, api_call=False):
+def benchmark_get_local_files(num_dirs=200, files_per_dir=500):
     """
-    Recursively get all objects in S3 bucket that match the s3_path pattern.
+    Time get_local_files against the former glob-based implementation on a synthetic tree of checkpoints.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(num_dirs):
+            run_dir = os.path.join(root, 'ckpt', f'run_{i}')
+            os.makedirs(os.path.join(run_dir, 'logs'))
+            for j in range(files_per_dir):
+                open(os.path.join(run_dir, f'shard_{j}.pt'), 'w').close()
+            open(os.path.join(run_dir, 'logs', 'train.log'), 'w').close()
+        logger.info(f"Tree of {num_dirs * (files_per_dir + 1)} files")
+        for s3_path in ['ckpt', 'ckpt/run_1*', 'ckpt/*/logs/*.log', 'ckpt/run_7/shard_1*']:
+            timings = []
+            for implementation in (get_local_files_glob, get_local_files):
+                start = time.perf_counter()
+                files = implementation(s3_path, root)
+                timings.append((time.perf_counter() - start, sorted(files)))
+            (baseline, expected), (elapsed, actual) = timings
+            logger.info(
+                f"{s3_path}: {len(actual)} files, glob {baseline * 1000:.1f} ms, scandir {elapsed * 1000:.1f} ms "
+                f"({baseline / elapsed:.1f}x){'' if actual == expected else ', RESULTS DIFFER'}"
+            )
+
+
+def iter_s3_prefix(prefix, delimiter=''):
+    """
+    Yield the objects and sub-prefixes under the prefix page by page, going through the listing cache.
+    A listing is only cached once it has been read to the end.
+
+    :return: Generator of (dict mapping S3 key to {'size', 'etag', 'mtime'}, list of sub-prefixes) per page
+    """
+    cached = listing_cache.get(prefix, delimiter)
+    if cached is not None:
+        yield cached['objects'], cached['prefixes']
+        return
+
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix, Delimiter=delimiter)
+    listing = {'objects': {}, 'prefixes': []} if listing_cache.enabled() else None
+    for page in pages:
+        prefixes = [d['Prefix'] for d in page.get('CommonPrefixes', [])]
+        objects = {
+            obj['Key']: {
+                'size': obj['Size'],
+                'etag': obj['ETag'].strip('"'),
+                'mtime': obj['LastModified'].timestamp(),
+            }
+            for obj in page.get('Contents', [])
+        }
+        if listing is not None:
+            listing['objects'].update(objects)
+            listing['prefixes'].extend(prefixes)
+            if len(listing['objects']) > listing_cache.max_objects:
+                listing = None  # Too large to be worth caching
+        yield objects, prefixes
+    if listing is not None:
+        listing_cache.put(prefix, delimiter, listing)
+
+
+def list_s3_prefix(prefix, delimiter=''):
+    """
+    List the objects and sub-prefixes under the prefix, going through the listing cache.
+
+    :return: Tuple of (dict mapping S3 key to {'size', 'etag', 'mtime'}, list of sub-prefixes)
+    """
+    objects = {}
+    prefixes = []
+    for page_objects, page_prefixes in iter_s3_prefix(prefix, delimiter):
+        objects.update(page_objects)
+        prefixes.extend(page_prefixes)
+    return objects, prefixes
+
+
+def list_s3_prefixes(prefix):
+    """
+    List the immediate sub-prefixes ("directories") under the prefix.
+    """
+    return list_s3_prefix(prefix, '/')[1]
+
+
+def plan_s3_prefixes(s3_path):
+    """
+    Expand the wildcard directory segments of the pattern one level at a time, so that only
+    matching prefixes are descended into. A '*' in a directory segment matches exactly one level,
+    the expansion stops at the first '**' segment, and the last segment is always matched by fnmatch.
+
+    :return: List of (prefix, pattern) tuples, every matching key is a prefix followed by a match of the pattern
+    """
+    segments = s3_path.split('/')
+    prefixes = ['']
+    for i, segment in enumerate(segments[:-1]):
+        if '**' in segment:
+            break
+        if '*' not in segment:
+            prefixes = [prefix + segment + '/' for prefix in prefixes]
+            continue
+        with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+            listings = list(executor.map(list_s3_prefixes, prefixes))
+        prefixes = [
+            sub_prefix
+            for prefix, sub_prefixes in zip(prefixes, listings)
+            for sub_prefix in sub_prefixes
+            if fnmatch.fnmatch(sub_prefix[len(prefix):-1], segment)
+        ]
+        logger.debug(f"Expanded {segment} to {len(prefixes)} prefixes")
+    else:
+        i = len(segments) - 1
+    pattern = '/'.join(segments[i:])
+    return [(prefix, pattern) for prefix in prefixes]
+
+
+def iter_s3_manifest(s3_path):
+    """
+    Yield (key, {'size', 'etag', 'mtime'}) for all objects matching a pattern whose directory segments are literal.
     """
-    if api_call:
-        if api_server_online():
-            logger.debug(f"API server is online. Sending request to find {s3_path}...")
-            return send_request("find", s3_path)['message']
-        else:
-            logger.debug("API server is not online. Falling back to local implementation.")
-    
     wildcard_index = s3_path.find('*')
     if wildcard_index == -1:
         prefix = s3_path
         pattern = ''
     else:
         prefix = s3_path[:wildcard_index]
-        if prefix.endswith('/'):
-            prefix = prefix[:-1]
-            pattern = s3_path[len(prefix) + 1:]
+        pattern = s3_path[wildcard_index:]
+
+    for objects, _ in iter_s3_prefix(prefix):
+        for key, meta in objects.items():
+            # only apply fnmatch if there's a pattern to match
+            if not pattern or fnmatch.fnmatch(key[len(prefix):], pattern):
+                yield key, meta
+
+
+def list_s3_manifest(s3_path):
+    """
+    List all objects matching a pattern whose directory segments are literal.
+    """
+    return dict(iter_s3_manifest(s3_path))
+
+
+def iter_s3_objects(s3_path, limit=None):
+    """
+    Lazily yield the objects in S3 bucket that match the s3_path pattern, one listing page at a time.
+
+    :param s3_path: S3 prefix or wildcard pattern
+    :param limit: Stop after this many objects
+    :return: Generator of (key, {'size', 'etag', 'mtime'}) tuples
+    """
+    count = 0
+    for prefix, pattern in plan_s3_prefixes(s3_path):
+        for key, meta in iter_s3_manifest(prefix + pattern):
+            yield key, meta
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+
+def get_s3_manifest(s3_path):
+    """
+    Recursively list all objects in S3 bucket that match the s3_path pattern, indexed by exact key.
+
+    :param s3_path: S3 prefix or wildcard pattern
+    :return: Dict mapping S3 key to {'size', 'etag', 'mtime'}
+    """
+    plan = [prefix + pattern for prefix, pattern in plan_s3_prefixes(s3_path)]
+    manifest = {}
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        for listing in executor.map(list_s3_manifest, plan):
+            manifest.update(listing)
+    return manifest
+
+
+def get_s3_objects(s3_path, api_call=False, limit=None):
+    """
+    Recursively get all objects in S3 bucket that match the s3_path pattern.
+
+    :param limit: Return at most this many objects
+    """
+    if api_call:
+        if api_server_online():
+            logger.debug(f"API server is online. Sending request to find {s3_path}...")
+            return send_request("find", s3_path, limit=limit)['message']
         else:
-            pattern = s3_path[len(prefix):]
+            logger.debug("API server is not online. Falling back to local implementation.")
     
-    paginator = s3_client.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix)
+    if limit is not None:
+        return [key for key, _ in iter_s3_objects(s3_path, limit)]
+    return list(get_s3_manifest(s3_path))
 
-    filtered_s3_objects = []
-    for page in pages:
-        for obj in page.get('Contents', []):
-            key = obj['Key']
-            if pattern:  # only apply fnmatch if there's a pattern to match
-                if fnmatch.fnmatch(key[len(prefix):], pattern):
-                    filtered_s3_objects.append(key)
+
+def get_s3_key(local_file, local_path='./'):
+    """
+    Map a local file under local_path to its S3 key.
+    """
+    return os.path.normpath(os.path.relpath(local_file, local_path))
+
+
+def diff_trees(local, remote, changed=None):
+    """
+    Diff a local tree against a remote tree in linear time using hashed lookups.
+
+    :param local: Dict mapping keys to metadata (e.g. {'size', 'mtime'}), or an iterable of keys
+    :param remote: Dict mapping keys to metadata (e.g. {'size', 'etag', 'mtime'}), or an iterable of keys
+    :param changed: Callable (key, local_meta, remote_meta) -> bool for keys on both sides,
+                    default to comparing the 'size' entries when both sides carry metadata
+    :return: Tuple of (added, changed, deleted) keys, i.e. only local, different on both sides, only remote
+    """
+    if not isinstance(local, dict):
+        local = dict.fromkeys(local)
+    if not isinstance(remote, dict):
+        remote = dict.fromkeys(remote)
+    if changed is None:
+        def changed(key, local_meta, remote_meta):
+            if local_meta is None or remote_meta is None:
+                return False
+            return local_meta.get('size') != remote_meta.get('size')
+
+    added, modified = [], []
+    for key, local_meta in local.items():
+        if key not in remote:
+            added.append(key)
+        elif changed(key, local_meta, remote[key]):
+            modified.append(key)
+    deleted = [key for key in remote if key not in local]
+    return added, modified, deleted
+
+
+def benchmark_diff_trees(sizes=(10 ** 5, 10 ** 6), baseline_size=2000):
+    """
+    Time diff_trees on synthetic trees where 90% of the keys overlap and 1% of the shared keys changed.
+    The former any() scan is timed on a small sample and extrapolated, as it is quadratic.
+    """
+    for n in sizes:
+        local = {f"ckpt/run_{i // 1000}/shard_{i}.pt": {'size': i} for i in range(n)}
+        remote = {f"ckpt/run_{i // 1000}/shard_{i}.pt": {'size': i + (i % 100 == 0)} for i in range(n // 10, n + n // 10)}
+        start = time.perf_counter()
+        added, modified, deleted = diff_trees(local, remote)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"diff_trees with {n} keys: {elapsed * 1000:.1f} ms "
+            f"({len(added)} added, {len(modified)} changed, {len(deleted)} deleted)"
+        )
+
+    local_files = [f"ckpt/shard_{i}.pt" for i in range(baseline_size)]
+    s3_objects = [f"ckpt/shard_{i}.pt" for i in range(baseline_size // 10, baseline_size + baseline_size // 10)]
+    start = time.perf_counter()
+    [file for file in local_files if not any(file == s3_key for s3_key in s3_objects)]
+    elapsed = time.perf_counter() - start
+    for n in sizes:
+        logger.info(f"any() scan with {n} keys: ~{elapsed * (n / baseline_size) ** 2:.0f} s (extrapolated from {baseline_size} keys)")
+
+
+def compute_md5(file_path, block_size=1024 * 1024):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+ETAG_PART_SIZES = [8, 16, 5, 32, 64, 100, 128, 256, 512]  # MB, common multipart chunk sizes of S3 clients
+
+
+def compute_etag(file_path, part_size=None, block_size=1024 * 1024):
+    """
+    S3 ETag of a local file, hashed in a single streamed pass.
+
+    :param part_size: None for the ETag of a single-part upload (the MD5 digest),
+                      or the chunk size of a multipart upload, whose ETag is the MD5 of the parts' digests and the number of parts
+    """
+    if part_size is None:
+        return compute_md5(file_path, block_size)
+    return compute_etags(file_path, [part_size], block_size)[part_size]
+
+
+def compute_etags(file_path, part_sizes, block_size=1024 * 1024):
+    """
+    Multipart ETags of a local file for several chunk sizes, hashed in a single read of the file.
+
+    :return: Dict mapping each chunk size to the ETag
+    """
+    states = {part_size: [hashlib.md5(), 0, []] for part_size in part_sizes}  # Current part's MD5 and length, finished digests
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            block = memoryview(block)
+            for part_size, state in states.items():
+                offset = 0
+                while offset < len(block):
+                    n = min(part_size - state[1], len(block) - offset)
+                    state[0].update(block[offset:offset + n])
+                    state[1] += n
+                    offset += n
+                    if state[1] == part_size:
+                        state[2].append(state[0].digest())
+                        state[0], state[1] = hashlib.md5(), 0
+    etags = {}
+    for part_size, (md5, length, digests) in states.items():
+        if length or not digests:
+            digests.append(md5.digest())
+        etags[part_size] = f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+    return etags
+
+
+def infer_part_sizes(size, parts):
+    """
+    Chunk sizes that split a file of the given size into the given number of multipart parts, most likely first.
+    Chunk sizes that give the same parts as a previous one are skipped.
+    """
+    mb = 1024 * 1024
+    candidates = [S3_MULTIPART_CHUNKSIZE] + [n * mb for n in ETAG_PART_SIZES]
+    candidates += [-(-size // (parts * mb)) * mb, -(-size // parts)]  # Smallest whole MB, then smallest byte count
+    part_sizes = []
+    for part_size in candidates:
+        if part_size > 0 and -(-size // part_size) == max(parts, 1) and part_size not in part_sizes:
+            part_sizes.append(part_size)
+    if parts <= 1:
+        # Every chunk size not smaller than the file gives the same single part
+        return part_sizes[:1]
+    return part_sizes
+
+
+def etag_matches(file_path, etag, s3_key=None):
+    """
+    Whether a local file has the given S3 ETag, inferring the chunk size of multipart ETags.
+
+    :param s3_key: Key of the object, to ask S3 for the size of its first part when no inferred chunk size matches
+    :return: True or False, or None for a multipart ETag that matches none of the inferred chunk sizes
+             when the object's own chunk size is unknown
+    """
+    if '-' not in etag:
+        return compute_etag(file_path) == etag
+    parts = int(etag.rsplit('-', 1)[1])
+    part_sizes = infer_part_sizes(os.path.getsize(file_path), parts)
+    if part_sizes and etag in compute_etags(file_path, part_sizes).values():
+        return True
+    if s3_key is None:
+        return None
+    try:
+        part_size = get_s3_client().head_object(Bucket=S3_BUCKET_NAME, Key=s3_key, PartNumber=1)['ContentLength']
+    except ClientError as e:
+        logger.debug(f"Cannot get the chunk size of {s3_key}: {e}")
+        return None
+    return part_size not in part_sizes and compute_etag(file_path, part_size) == etag
+
+
+def verify_file(local_file, meta, s3_key=None):
+    """
+    Check a local file against the {'size', 'etag'} of its S3 object.
+
+    :param s3_key: Key of the object, to look up its multipart chunk size if it cannot be inferred
+    """
+    if meta is None:
+        return False
+    try:
+        if os.path.getsize(local_file) != meta['size']:
+            return False
+        matches = etag_matches(local_file, meta['etag'], s3_key)
+    except OSError:
+        return False
+    if matches is None:
+        logger.warning(f"Cannot infer the multipart chunk size of {local_file}, only its size is verified")
+        return True
+    return matches
+
+
+def verify_files(files, workers=None):
+    """
+    Verify local files against their S3 objects in parallel, as hashlib releases the GIL while hashing.
+
+    :param files: List of (local_file, meta) or (local_file, meta, s3_key) tuples
+    :return: List of the tuples that failed
+    """
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=workers or S3_MAX_WORKERS) as executor:
+        results = list(executor.map(lambda item: verify_file(*item), files))
+    return [item for item, ok in zip(files, results) if not ok]
+
+
+def head_s3_meta(s3_key):
+    """
+    {'size', 'etag', 'mtime'} of an S3 object, or None if it does not exist.
+    """
+    try:
+        response = get_s3_client().head_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+    except ClientError:
+        return None
+    return {'size': response['ContentLength'], 'etag': response['ETag'].strip('"'), 'mtime': response['LastModified'].timestamp()}
+
+
+def get_s3_manifest_of_keys(s3_keys, max_heads=16):
+    """
+    Manifest of the given keys, from one listing of their common directory. A few keys, or keys with no common
+    directory, are looked up with one HeadObject each instead, so that the whole bucket is never listed.
+
+    :param max_heads: Largest number of keys looked up one by one when they share a directory
+    :return: Dict mapping each existing key to {'size', 'etag', 'mtime'}
+    """
+    s3_keys = sorted(set(s3_keys))
+    if not s3_keys:
+        return {}
+    directories = [os.path.dirname(s3_key) for s3_key in s3_keys]
+    directory = '' if '' in directories else os.path.commonpath(directories)
+    if directory and len(s3_keys) > max_heads:
+        manifest = get_s3_manifest(directory + '/')
+        return {s3_key: manifest[s3_key] for s3_key in s3_keys if s3_key in manifest}
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        metas = executor.map(head_s3_meta, s3_keys)
+    return {s3_key: meta for s3_key, meta in zip(s3_keys, metas) if meta is not None}
+
+
+def local_file_changed(local_file, remote, mode='mtime'):
+    """
+    Check whether a local file differs from its S3 manifest entry.
+
+    :param mode: 'mtime' treats a local file newer than the S3 object as changed,
+                 'md5' compares the content hash with the ETag
+    """
+    stat = os.stat(local_file)
+    if stat.st_size != remote['size']:
+        return True
+    if mode == 'md5':
+        matches = etag_matches(local_file, remote['etag'])
+        if matches is not None:
+            return not matches
+    # Fall back to the modification time when the ETag cannot be reproduced
+    return stat.st_mtime > remote['mtime']
+
+
+def is_partial_file(path):
+    """
+    Whether a local file is an unfinished download or its journal.
+    """
+    return path.endswith(S3_PART_SUFFIX) or path.endswith(S3_PART_SUFFIX + '.json')
+
+
+def read_journal(journal_path, header):
+    """
+    Read a JSON lines journal whose first line must equal header, return the later records or None if it doesn't match.
+    A record cut short by an interruption is ignored.
+    """
+    try:
+        with open(journal_path, 'r') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            break
+    if not records or records[0] != header:
+        return None
+    return records[1:]
+
+
+def download_s3_file_resumable(s3_key, local_file_path, meta, callback=None):
+    """
+    Download a large object in ranged parts into <file>.s3part, recording finished parts in <file>.s3part.json,
+    so that an interrupted download resumes from the parts it already has.
+
+    :param meta: {'size', 'etag'} of the object, the journal is discarded if they changed
+    :return: Number of bytes of the object
+    """
+    part_path = local_file_path + S3_PART_SUFFIX
+    journal_path = part_path + '.json'
+    size, chunksize = meta['size'], S3_MULTIPART_CHUNKSIZE
+    header = {'key': s3_key, 'etag': meta['etag'], 'size': size, 'chunksize': chunksize}
+    records = read_journal(journal_path, header) if os.path.exists(part_path) else None
+    if records is None:
+        with open(journal_path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+        records = []
+    done = {record['part'] for record in records}
+    todo = [part for part in range((size + chunksize - 1) // chunksize) if part not in done]
+    if done:
+        logger.info(f"Resuming {s3_key}: {len(done)} of {len(done) + len(todo)} parts already downloaded")
+        if callback:
+            callback(min(size, len(done) * chunksize))
+
+    journal_lock = threading.Lock()
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT)
+    try:
+        os.ftruncate(fd, size)
+        with open(journal_path, 'a') as journal:
+            def download_part(part):
+                start = part * chunksize
+                end = min(start + chunksize, size) - 1
+                response = get_s3_client().get_object(
+                    Bucket=S3_BUCKET_NAME, Key=s3_key, Range=f'bytes={start}-{end}', IfMatch=f'"{meta["etag"]}"'
+                )
+                offset = start
+                for chunk in response['Body'].iter_chunks(1024 * 1024):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    if callback:
+                        callback(len(chunk))
+                if offset != end + 1:
+                    raise IOError(f"Part {part} of {s3_key} is incomplete")
+                with journal_lock:
+                    journal.write(json.dumps({'part': part}) + '\n')
+                    journal.flush()
+
+            with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY) as executor:
+                for future in [executor.submit(download_part, part) for part in todo]:
+                    future.result()
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', '412'):
+            # The object changed since it was listed, the parts we have are useless
+            os.remove(journal_path)
+            os.remove(part_path)
+        raise
+    finally:
+        os.close(fd)
+    os.replace(part_path, local_file_path)
+    os.remove(journal_path)
+    return size
+
+
+def fetch_s3_file(s3_key, local_file_path, callback=None, meta=None):
+    """
+    Download a single S3 object to a temporary file and rename it when complete, return the number of bytes.
+    """
+    if meta is not None and meta['size'] > S3_MULTIPART_CHUNKSIZE:
+        return download_s3_file_resumable(s3_key, local_file_path, meta, callback)
+    part_path = local_file_path + S3_PART_SUFFIX
+    get_s3_client().download_file(S3_BUCKET_NAME, s3_key, part_path, Config=get_transfer_config(), Callback=callback)
+    os.replace(part_path, local_file_path)
+    return os.path.getsize(local_file_path)
+
+
+FICLONE = 0x40049409  # Linux ioctl to reflink a file
+
+
+def link_file(src, dst):
+    """
+    Make dst a copy of src without copying the data if the file system allows: reflink, then hardlink, then copy.
+    """
+    tmp_path = dst + S3_PART_SUFFIX
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        with open(src, 'rb') as src_file, open(tmp_path, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        os.remove(tmp_path)
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class ObjectCache():
+    """
+    Content-addressed cache of S3 objects shared by all projects on a node, keyed by ETag and size.
+    Files are linked from the cache into each project, entries are locked with flock so that concurrent
+    processes download an object only once, and the least recently used entries are evicted beyond max_bytes.
+    Cached files are read-only, as hardlinked copies share their data with the cache.
+    """
+    def __init__(self, path=S3_CACHE_DIR, max_bytes=S3_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def enabled(self):
+        return bool(self.path)
+
+    def entry_path(self, meta):
+        name = f"{meta['etag']}-{meta['size']}"
+        return os.path.join(self.path, 'objects', name[:2], name)
+
+    def fetch(self, s3_key, local_file_path, meta, callback=None):
+        """
+        Link an object into local_file_path, downloading it into the cache first if it is missing.
+        """
+        entry_path = self.entry_path(meta)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        with open(entry_path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # The lock file's mtime records the last use, the entry's own is shared with its hardlinks
+            os.utime(lock.name)
+            if os.path.exists(entry_path):
+                logger.debug(f"Object cache hit for {s3_key}")
+                num_bytes = meta['size']
             else:
-                filtered_s3_objects.append(key)
-    return filtered_s3_objects
+                num_bytes = fetch_s3_file(s3_key, entry_path, callback, meta)
+                os.chmod(entry_path, 0o444)
+            link_file(entry_path, local_file_path)
+        return num_bytes
+
+    def discard(self, meta):
+        """
+        Remove an entry, e.g. one that failed verification.
+        """
+        entry_path = self.entry_path(meta)
+        if not os.path.exists(entry_path):
+            return
+        with open(entry_path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        if not self.enabled() or not self.max_bytes:
+            return
+        objects_dir = os.path.join(self.path, 'objects')
+        os.makedirs(objects_dir, exist_ok=True)
+        with open(os.path.join(self.path, 'evict.lock'), 'a') as evict_lock:
+            try:
+                fcntl.flock(evict_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another process is evicting
+            entries = []
+            for shard in os.scandir(objects_dir):
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.lock') or is_partial_file(entry.name):
+                        continue
+                    try:
+                        last_used = os.stat(entry.path + '.lock').st_mtime
+                    except FileNotFoundError:
+                        last_used = 0
+                    entries.append((last_used, entry.stat().st_size, entry.path))
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                with open(path + '.lock', 'a') as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # Being downloaded or linked
+                    os.remove(path)
+                total_bytes -= size
+                logger.debug(f"Evicted {path} from the object cache")
+
+
+object_cache = ObjectCache()
+
+
+def download_s3_file(s3_key, local_file_path, callback=None, meta=None):
+    """
+    Download a single S3 object, return the number of bytes downloaded or None on failure.
+    The file only appears under its name once it is complete, so an interrupted download is never mistaken for one.
+
+    :param callback: Called with the number of bytes of every chunk transferred
+    :param meta: {'size', 'etag'} of the object if known, large objects are then downloaded resumably
+                 and the object cache is used if S3_CACHE_DIR is set
+    """
+    try:
+        if meta is not None and object_cache.enabled():
+            num_bytes = object_cache.fetch(s3_key, local_file_path, meta, callback)
+        else:
+            num_bytes = fetch_s3_file(s3_key, local_file_path, callback, meta)
+        logger.info(f"Downloaded {s3_key} to {local_file_path}")
+        return num_bytes
+    except (ClientError, OSError) as e:
+        logger.error(f"Failed to download {s3_key}: {e}")
 
 
-def download_s3_objects(s3_objects, local_path='./'):
+def verify_download(s3_key, local_file_path, meta=None):
+    """
+    Check a downloaded file against its S3 object, and remove it if it does not match so that it can be downloaded again.
+    """
+    meta = meta or head_s3_meta(s3_key)
+    if verify_file(local_file_path, meta, s3_key):
+        return True
+    logger.warning(f"{local_file_path} does not match s3://{S3_BUCKET_NAME}/{s3_key}")
+    if os.path.exists(local_file_path):
+        os.remove(local_file_path)
+    if meta is not None and object_cache.enabled():
+        object_cache.discard(meta)
+    return False
+
+
+def verify_upload(local_file, s3_key):
+    """
+    Check an uploaded object against the local file.
+    """
+    if verify_file(local_file, head_s3_meta(s3_key), s3_key):
+        return True
+    logger.warning(f"s3://{S3_BUCKET_NAME}/{s3_key} does not match {local_file}")
+    return False
+
+
+def download_s3_objects(s3_objects, local_path='./', workers=None, verify=False):
     """
     Download specified S3 objects to the local file system.
 
-    :param s3_objects: List of S3 keys to download
+    :param s3_objects: Iterable of S3 keys, or of (key, meta) pairs as yielded by iter_s3_objects to download large files
+                       resumably, consumed lazily so transfers start on the first key
     :param local_path: Local directory to save the files
+    :param workers: Number of concurrent downloads, default to S3_MAX_WORKERS
+    :param verify: Check the size and ETag of every downloaded file and download the ones that differ again
     """
-    rtn = []
-    for s3_key in s3_objects:
-        # Construct the full local filepath
-        local_file_path = os.path.join(local_path, s3_key)
-
-        # Create directory if it doesn't exist
-        local_file_dir = os.path.dirname(local_file_path)
-        if not os.path.exists(local_file_dir):
-            os.makedirs(local_file_dir)
+    def jobs():
+        for s3_object in s3_objects:
+            s3_key, meta = s3_object if isinstance(s3_object, tuple) else (s3_object, None)
+            # Construct the full local filepath
+            local_file_path = os.path.join(local_path, s3_key)
+
+            # Create directory if it doesn't exist
+            local_file_dir = os.path.dirname(local_file_path)
+            if not os.path.exists(local_file_dir):
+                os.makedirs(local_file_dir, exist_ok=True)
+
+            # Check if the file already exists locally
+            if os.path.exists(local_file_path):
+                logger.warning(f"File {local_file_path} already exists. Skipping download.")
+                continue
+            yield s3_key, local_file_path, meta
 
-        # Check if the file already exists locally
-        if os.path.exists(local_file_path):
-            logger.warning(f"File {local_file_path} already exists. Skipping download.")
-            continue
+    def download(s3_key, local_file_path, meta, callback=None):
+        return download_s3_file(s3_key, local_file_path, callback, meta)
 
-        # Download the file from S3
-        try:
-            s3_client.download_file(S3_BUCKET_NAME, s3_key, local_file_path)
-            logger.info(f"Downloaded {s3_key} to {local_file_path}")
-            rtn.append(os.path.normpath(local_file_path))
-        except ClientError as e:
-            logger.error(f"Failed to download {s3_key}: {e}")
-    return rtn
+    succeeded = run_transfers(jobs(), download, workers, operation='download', verify=verify_download if verify else None)
+    object_cache.evict()
+    return [os.path.normpath(local_file_path) for _, local_file_path, _ in succeeded]
 
 
-def download_s3_path(s3_path, local_path='./', api_call=False):
+def download_s3_path(s3_path, local_path='./', api_call=False, verify=False):
     """
     Download all files in the S3 path to the local file system.
+
+    :param verify: Check the size and ETag of every downloaded file and download the ones that differ again
     """
     if api_call:
         if api_server_online():
             logger.debug(f"API server is online. Sending request to download {s3_path}...")
-            return send_request("download", s3_path)['message']
+            return send_request("download", s3_path, verify=verify)['message']
         else:
             logger.debug("API server is not online. Falling back to local implementation.")
     
     # Remove the trailing '*' 
     s3_path = s3_path.rstrip('*')
     s3_path = os.path.normpath(s3_path)
-    s3_objects = get_s3_objects(s3_path)
+    
+    # The node cache is only consulted by the built-in engine, so it takes precedence over s5cmd
+    if not use_s5cmd() or object_cache.enabled():
+        # Start downloading on the first listing page while later pages are still being fetched
+        s3_objects = (
+            (s3_key, meta) for s3_key, meta in iter_s3_objects(s3_path)
+            if not os.path.exists(os.path.join(local_path, s3_key))  # Skip files that already exist locally
+        )
+        downloaded = download_s3_objects(s3_objects, local_path, verify=verify)
+        if len(downloaded) == 0:
+            logger.error(f"No new files found in {s3_path}")
+        return downloaded
+
+    manifest = get_s3_manifest(s3_path)
     
     # Skip files that already exist locally
-    s3_objects = [s3_key for s3_key in s3_objects if not os.path.exists(os.path.join(local_path, s3_key))]
+    s3_objects = [s3_key for s3_key in manifest if not os.path.exists(os.path.join(local_path, s3_key))]
     
     if len(s3_objects) == 0:
         logger.error(f"No new files found in {s3_path}")
         return []
     
     # If there is no wildcard in the middle
-    if use_s5cmd():
-        if '*' not in s3_path:
-            s3_path = s3_path.rstrip('/')
-            prefix = f"s3://{S3_BUCKET_NAME}/{s3_path}"
-            
-            dest = os.path.join(local_path, s3_path)
-            if len(s3_objects) == 1 and s3_objects[0] == s3_path:
-                # single file
-                run_s5cmd(f"s5cmd cp -n --sp {prefix} {dest}")
-            elif s3_objects[0].startswith(s3_path + "/"):
-                # directory
-                run_s5cmd(f"s5cmd cp -n --sp '{prefix}/*' {dest}/")
-            else:
-                # non-dir prefix
-                run_s5cmd(f"s5cmd cp -n --sp '{prefix}*' {os.path.dirname(dest)}")
-        else:  # Download one by one
-            commands = ""
-            for s3_key in s3_objects:
-                dest = os.path.join(local_path, s3_key)
-                s5cmd_command = f"s5cmd cp -n --sp s3://{S3_BUCKET_NAME}/{s3_key} {dest}"
-                commands += s5cmd_command + " && "
-            commands = commands[:-4]
-            run_s5cmd(commands)
+    if '*' not in s3_path:
+        s3_path = s3_path.rstrip('/')
+        prefix = f"s3://{S3_BUCKET_NAME}/{s3_path}"
         
-        return s3_objects
-    else:
-        return download_s3_objects(s3_objects, local_path)
+        dest = os.path.join(local_path, s3_path)
+        if len(s3_objects) == 1 and s3_objects[0] == s3_path:
+            # single file
+            commands = [f'cp -n "{prefix}" "{dest}"']
+        elif s3_objects[0].startswith(s3_path + "/"):
+            # directory
+            commands = [f'cp -n "{prefix}/*" "{dest}/"']
+        else:
+            # non-dir prefix
+            commands = [f'cp -n "{prefix}*" "{os.path.dirname(dest)}/"']
+    else:  # Download file by file in a single s5cmd process
+        commands = [
+            f'cp -n "s3://{S3_BUCKET_NAME}/{s3_key}" "{os.path.join(local_path, s3_key)}"'
+            for s3_key in s3_objects
+        ]
+    total_bytes = sum(manifest[s3_key]['size'] for s3_key in s3_objects)
+    succeeded, _ = run_s5cmd_batch(commands, operation='download', total_bytes=total_bytes)
+    sources = {result['source'] for result in succeeded}
+    downloaded = [s3_key for s3_key in s3_objects if f"s3://{S3_BUCKET_NAME}/{s3_key}" in sources]
+    if verify:
+        downloaded = verify_s5cmd_downloads(downloaded, manifest, local_path)
+    return downloaded
+
+
+def verify_s5cmd_downloads(s3_keys, manifest, local_path):
+    """
+    Verify files downloaded by s5cmd and download the ones that differ again, return the keys that passed.
+    Only the files downloaded again are verified a second time.
+    """
+    def failed_keys(keys):
+        failed = verify_files([(os.path.join(local_path, s3_key), manifest[s3_key], s3_key) for s3_key in keys])
+        failed_files = {local_file for local_file, _, _ in failed}
+        for local_file in failed_files:
+            logger.warning(f"{local_file} failed verification")
+            if os.path.exists(local_file):
+                os.remove(local_file)
+        return [s3_key for s3_key in keys if os.path.join(local_path, s3_key) in failed_files]
+
+    failed = failed_keys(s3_keys)
+    if failed:
+        commands = [f'cp "s3://{S3_BUCKET_NAME}/{s3_key}" "{os.path.join(local_path, s3_key)}"' for s3_key in failed]
+        run_s5cmd_batch(commands, operation='download', total_bytes=sum(manifest[s3_key]['size'] for s3_key in failed))
+        failed = failed_keys(failed)
+        if failed:
+            logger.error(f"{len(failed)} files failed verification again")
+    failed = set(failed)
+    return [s3_key for s3_key in s3_keys if s3_key not in failed]
+
+
+class S3File(io.RawIOBase):
+    """
+    Read-only, seekable file object over an S3 object, so that a reader only fetches the bytes it touches.
+    The object is read in blocks with ranged GetObject calls pinned to its ETag. Recent blocks are kept in an LRU cache,
+    and sequential reads fetch the next blocks in the background.
+
+    With spill_path, fetched blocks are also written to a sparse local file of the object's size. fetch() fills in
+    byte ranges in parallel and mmap() maps the file; ranges that were never fetched read as zeros.
+
+    :param s3_key: Key of the object
+    :param block_size: Size of each ranged read
+    :param cache_blocks: Number of blocks kept in memory
+    :param readahead: Number of blocks fetched ahead of sequential reads, 0 to disable
+    :param spill_path: Local file to keep the fetched blocks in
+    """
+    def __init__(self, s3_key, block_size=S3_READ_BLOCK_SIZE, cache_blocks=32, readahead=2, spill_path=None):
+        super().__init__()
+        meta = head_s3_meta(s3_key)
+        if meta is None:
+            raise FileNotFoundError(f"s3://{S3_BUCKET_NAME}/{s3_key}")
+        self.key = s3_key
+        self.size = meta['size']
+        self.etag = meta['etag']
+        self.block_size = block_size
+        self.cache_blocks = max(1, cache_blocks)
+        self.readahead = readahead
+        self.position = 0
+        self.last_block = None
+        self.blocks = OrderedDict()  # Block index -> bytes
+        self.inflight = {}  # Block index -> Future
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=min(readahead, S3_MAX_CONCURRENCY)) if readahead > 0 else None
+        self.spill_path = spill_path
+        self.spill_fd = None
+        self.spilled = set()
+        if spill_path:
+            os.makedirs(os.path.dirname(spill_path) or '.', exist_ok=True)
+            self.spill_fd = os.open(spill_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+            os.ftruncate(self.spill_fd, self.size)  # Sparse until blocks are written
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.position = position
+        return position
+
+    def load(self, index):
+        """
+        Read a block from the spill file if it is there, else from S3.
+        """
+        start = index * self.block_size
+        length = min(self.block_size, self.size - start)
+        if index in self.spilled:
+            return os.pread(self.spill_fd, length, start)
+        response = get_s3_client().get_object(
+            Bucket=S3_BUCKET_NAME, Key=self.key, Range=f'bytes={start}-{start + length - 1}', IfMatch=f'"{self.etag}"'
+        )
+        data = response['Body'].read()
+        if len(data) != length:
+            raise IOError(f"Short read of block {index} of {self.key}")
+        if self.spill_fd is not None:
+            os.pwrite(self.spill_fd, data, start)
+            with self.lock:
+                self.spilled.add(index)
+        return data
+
+    def block(self, index):
+        """
+        Block from the cache, waiting for it if another thread is already fetching it.
+        """
+        with self.lock:
+            data = self.blocks.get(index)
+            if data is not None:
+                self.blocks.move_to_end(index)
+                return data
+            future = self.inflight.get(index)
+            owner = future is None
+            if owner:
+                future = self.inflight[index] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            data = self.load(index)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(index, None)
+        with self.lock:
+            self.blocks[index] = data
+            while len(self.blocks) > self.cache_blocks:
+                self.blocks.popitem(last=False)
+        future.set_result(data)
+        return data
+
+    def read_ahead(self, index):
+        if self.executor is None or index == self.last_block:
+            return
+        sequential = self.last_block is None or index == self.last_block + 1
+        self.last_block = index
+        if not sequential:
+            return
+        with self.lock:
+            upcoming = [
+                i for i in range(index + 1, min(index + 1 + self.readahead, (self.size - 1) // self.block_size + 1))
+                if i not in self.blocks and i not in self.inflight
+            ]
+        for i in upcoming:
+            self.executor.submit(self.block, i)
+
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(buffer).cast('B')
+        num_bytes = max(0, min(len(view), self.size - self.position))
+        done = 0
+        while done < num_bytes:
+            index, offset = divmod(self.position, self.block_size)
+            data = self.block(index)
+            self.read_ahead(index)
+            length = min(len(data) - offset, num_bytes - done)
+            view[done:done + length] = data[offset:offset + length]
+            done += length
+            self.position += length
+        return num_bytes
+
+    def fetch(self, start=0, end=None):
+        """
+        Fetch the blocks covering bytes [start, end) into the spill file in parallel, default to the whole object.
+        """
+        if self.spill_fd is None:
+            raise ValueError("fetch() needs a spill_path")
+        end = self.size if end is None else min(end, self.size)
+        if end <= start:
+            return
+        indices = range(start // self.block_size, (end - 1) // self.block_size + 1)
+        with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY) as executor:
+            list(executor.map(self.load, [index for index in indices if index not in self.spilled]))
+
+    def mmap(self):
+        """
+        Read-only memory map of the spill file, call fetch() first for the ranges that will be read.
+        """
+        if self.spill_fd is None:
+            raise ValueError("mmap() needs a spill_path")
+        return mmap.mmap(self.spill_fd, self.size, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if not self.closed:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+            if self.spill_fd is not None:
+                os.close(self.spill_fd)
+                self.spill_fd = None
+        super().close()
+
+
+class S3Stream():
+    """
+    Stream the objects matching an S3 pattern without downloading the dataset first.
+    Objects are fetched into memory by a background pool that keeps `prefetch` of them in flight, and yielded in order.
+    Use it as S3Dataset, which is also a torch IterableDataset when torch is installed.
+
+    The keys are sharded by rank and by DataLoader worker, after an optional shuffle that all ranks agree on.
+
+    :param s3_path: S3 prefix or wildcard pattern, resolved with get_s3_objects
+    :param shuffle: Shuffle the keys, with seed + epoch (see set_epoch)
+    :param seed: Seed of the shuffle
+    :param prefetch: Number of objects fetched ahead
+    :param workers: Number of threads fetching objects
+    :param rank: Rank of this process, default to torch.distributed or $RANK
+    :param world_size: Number of processes, default to torch.distributed or $WORLD_SIZE
+    :param drop_last: Drop the last keys so that every rank gets the same number of objects. By default keys are
+                      repeated instead, like DistributedSampler, so that DDP collectives do not hang at the end of an epoch
+    :param transform: Callable applied to (key, bytes) to produce a sample, by default the tuple itself is yielded
+    :param api_call: Resolve the pattern through the API server
+    """
+    def __init__(
+        self, s3_path, shuffle=False, seed=0, prefetch=8, workers=4,
+        rank=None, world_size=None, drop_last=False, transform=None, api_call=False
+    ):
+        self.s3_path = s3_path
+        self.keys = sorted(get_s3_objects(s3_path, api_call=api_call))
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.prefetch = max(1, prefetch)
+        self.workers = max(1, workers)
+        self.drop_last = drop_last
+        self.transform = transform
+        default_rank, default_world_size = self.distributed()
+        self.rank = default_rank if rank is None else rank
+        self.world_size = default_world_size if world_size is None else world_size
+
+    @staticmethod
+    def distributed():
+        if 'torch' in sys.modules:
+            import torch.distributed as dist
+            if dist.is_available() and dist.is_initialized():
+                return dist.get_rank(), dist.get_world_size()
+        return int(os.getenv('RANK', 0)), int(os.getenv('WORLD_SIZE', 1))
+
+    @staticmethod
+    def worker():
+        # DataLoader worker of this process, if any
+        if 'torch' in sys.modules:
+            from torch.utils.data import get_worker_info
+            info = get_worker_info()
+            if info is not None:
+                return info.id, info.num_workers
+        return 0, 1
+
+    def set_epoch(self, epoch):
+        """
+        Reshuffle for a new epoch, like DistributedSampler.set_epoch.
+        """
+        self.epoch = epoch
+
+    def rank_keys(self):
+        keys = list(self.keys)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(keys)
+        if self.drop_last:
+            keys = keys[:len(keys) - len(keys) % self.world_size]
+        elif keys:
+            padding = -len(keys) % self.world_size
+            keys += (keys * -(-padding // len(keys)))[:padding]
+        return keys[self.rank::self.world_size]
+
+    def __len__(self):
+        return len(self.rank_keys())
+
+    def fetch(self, s3_key):
+        return get_s3_client().get_object(Bucket=S3_BUCKET_NAME, Key=s3_key)['Body'].read()
+
+    def __iter__(self):
+        worker_id, num_workers = self.worker()
+        keys = iter(self.rank_keys()[worker_id::num_workers])
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            pending = deque((key, executor.submit(self.fetch, key)) for key in itertools.islice(keys, self.prefetch))
+            while pending:
+                key, future = pending.popleft()
+                for next_key in itertools.islice(keys, 1):
+                    pending.append((next_key, executor.submit(self.fetch, next_key)))
+                data = future.result()
+                yield self.transform(key, data) if self.transform else (key, data)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_list_s3_objects(s3_path, limit=None):
+    """
+    Lazily yield the directories / files in S3 bucket directly under the given path, one listing page at a time.
+
+    :param limit: Stop after this many entries
+    :return: Generator of (name, meta) tuples, where meta is None for directories and {'size', 'etag', 'mtime'} for files
+    """
+    if s3_path.startswith('./'):
+        s3_path = s3_path[2:]
+    prefix = s3_path.lstrip('/')
+
+    count = 0
+    for objects, directories in iter_s3_prefix(prefix, '/'):
+        entries = [(d, None) for d in directories]
+        # Skip directory markers, as directories are already handled above
+        entries += [(key, meta) for key, meta in objects.items() if not key.endswith('/')]
+        for entry in entries:
+            yield entry
+            count += 1
+            if limit is not None and count >= limit:
+                return
 
 
-def list_s3_objects(s3_path, api_call=False):
+def list_s3_objects(s3_path, api_call=False, limit=None):
     """
     List all directories / files in S3 bucket under the given path.
+
+    :param limit: List at most this many entries
     """
     if api_call:
         if api_server_online():
             logger.debug(f"API server is online. Sending request to list {s3_path}...")
-            return send_request("list", s3_path)['message']
+            return send_request("list", s3_path, limit=limit)['message']
         else:
             logger.debug("API server is not online. Falling back to local implementation.")
     
-    if s3_path.startswith('./'):
-        s3_path = s3_path[2:]
-    prefix = s3_path.lstrip('/')
-
-    paginator = s3_client.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix, Delimiter='/')
-    objects = []
-    directories = []
     rtn = []
+    for name, meta in iter_list_s3_objects(s3_path, limit):
+        if meta is None:
+            logger.info(f"Directory: {name}")
+        else:
+            logger.info(f"File: {name}")
+        rtn.append(name)
 
-    for page in page_iterator:
-        directories.extend(page.get('CommonPrefixes', []))
-        objects.extend(page.get('Contents', []))
+    return rtn
 
-    for d in directories:
-        logger.info(f"Directory: {d['Prefix']}")
-        rtn.append(d['Prefix'])
 
-    for obj in objects:
-        if obj['Key'].endswith('/'):
-            # Skip directories, as they are already handled above
-            continue
-        logger.info(f"File: {obj['Key']}")
-        rtn.append(obj['Key'])
+def delete_local_batch(files, dry_run=False):
+    """
+    Delete a batch of local files, or only stat them in a dry run.
 
-    return rtn
+    :return: Tuple of (list of (file, size) deleted or to delete, dict mapping each failed file to its error)
+    """
+    deleted = []
+    failed = {}
+    for file in files:
+        try:
+            size = os.lstat(file).st_size
+            if not dry_run:
+                os.remove(file)
+            deleted.append((file, size))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            failed[file] = e
+    return deleted, failed
+
+
+def prune_empty_folders(folders, root=None):
+    """
+    Remove empty folders bottom-up in one pass, so that folders left empty by their subfolders are removed too.
+
+    :param folders: Folders that may have become empty
+    :param root: Folder that is kept, its ancestors are never visited. Default to only the given folders.
+    :return: List of removed folders
+    """
+    root = os.path.abspath(root) if root is not None else None
+    candidates = set()
+    for folder in folders:
+        folder = os.path.abspath(folder)
+        while folder not in candidates and folder != root:
+            candidates.add(folder)
+            parent = os.path.dirname(folder)
+            if root is None or parent == folder or os.path.commonpath([parent, root]) != root:
+                break
+            folder = parent
+    removed = []
+    for folder in sorted(candidates, key=lambda folder: folder.count(os.sep), reverse=True):
+        try:
+            os.rmdir(folder)
+            removed.append(folder)
+        except OSError:  # Not empty, or already gone
+            pass
+    return removed
 
 
-def delete_local_files(local_files):
+def delete_local_files(local_files, root=None, workers=None, batch_size=None, dry_run=False):
     """
-    Delete local files.
+    Delete local files in parallel batches, then remove the folders they leave empty.
+
+    :param root: Folder whose emptied subfolders are removed, e.g. local_path. Default to the parents of the files.
+    :param batch_size: Files per batch, default to spreading them over the workers, at most 1000 per batch
+    :param dry_run: Only log the number of files and bytes that would be deleted
+    :return: List of deleted files, or of the files that would be deleted in a dry run
     """
-    for file in local_files:
-        os.remove(file)
-        logger.info(f"Deleted {file}")
-        ## Delete empty folders if any
-        folder = os.path.dirname(file)
-        if not os.listdir(folder):
-            os.rmdir(folder)
-            logger.info(f"Deleted {folder}")
+    local_files = list(local_files)
+    workers = workers or S3_MAX_WORKERS
+    batch_size = batch_size or min(1000, max(1, -(-len(local_files) // workers)))
+    batches = [local_files[i:i + batch_size] for i in range(0, len(local_files), batch_size)]
+    rtn = []
+    num_bytes = 0
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for deleted, batch_failed in executor.map(lambda batch: delete_local_batch(batch, dry_run), batches):
+            for file, size in deleted:
+                if not dry_run:
+                    logger.info(f"Deleted {file}")
+                rtn.append(file)
+                num_bytes += size
+            failed.update(batch_failed)
+    for file, error in failed.items():
+        logger.error(f"Failed to delete {file}: {error}")
+    if dry_run:
+        logger.info(f"Dry run: would delete {len(rtn)} files ({format_size(num_bytes)})")
+        return rtn
+    folders = prune_empty_folders({os.path.dirname(file) or '.' for file in rtn}, root)
+    for folder in folders:
+        logger.info(f"Deleted {os.path.relpath(folder)}/")
+    logger.info(f"Deleted {len(rtn)} files ({format_size(num_bytes)}) and {len(folders)} empty folders")
+    return rtn
 
 
 def print_folders(files):
@@ -317,17 +1956,65 @@ def print_folders(files):
             last_folder = folder
 
 
-def remove_s3_objects(objects_to_delete):
+def remove_s3_batch(keys, retries=5):
+    """
+    Remove at most S3_DELETE_BATCH_SIZE keys with one DeleteObjects call.
+    Throttled calls are already retried by the client, so only the keys that S3 reports as throttled
+    are retried here, with exponential backoff.
+
+    :return: Tuple of (removed keys, dict mapping each failed key to its error)
+    """
+    removed = []
+    failed = {}
+    pending = list(keys)
+    for attempt in range(retries + 1):
+        try:
+            response = get_s3_client().delete_objects(
+                Bucket=S3_BUCKET_NAME,
+                Delete={'Objects': [{'Key': key} for key in pending], 'Quiet': True}
+            )
+        except (ClientError, BotoCoreError) as e:
+            failed.update({key: str(e) for key in pending})
+            break
+
+        errors = {error['Key']: error for error in response.get('Errors', [])}
+        removed += [key for key in pending if key not in errors]
+        pending = []
+        for key, error in errors.items():
+            if error['Code'] in S3_RETRYABLE_ERRORS and attempt < retries:
+                pending.append(key)
+            else:
+                failed[key] = f"{error['Code']}: {error.get('Message', '')}"
+        if not pending:
+            break
+        time.sleep(min(2 ** attempt * 0.5, 30))
+    return removed, failed
+
+
+def remove_s3_objects(objects_to_delete, workers=None):
     """
-    Remove objects in S3.
+    Remove objects in S3, in concurrent batches of at most S3_DELETE_BATCH_SIZE keys.
+
+    :return: List of removed keys, keys that failed are logged as errors
     """
+    objects_to_delete = list(objects_to_delete)
+    batches = [
+        objects_to_delete[i:i + S3_DELETE_BATCH_SIZE]
+        for i in range(0, len(objects_to_delete), S3_DELETE_BATCH_SIZE)
+    ]
     rtn = []
-    objects_to_delete = [{'Key': obj} for obj in objects_to_delete]
-    if objects_to_delete:
-        s3_client.delete_objects(Bucket=S3_BUCKET_NAME, Delete={'Objects': objects_to_delete})
-        for obj in objects_to_delete:
-            logger.info(f"Removed {obj['Key']} from S3")
-            rtn.append(obj['Key'])
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers or S3_MAX_WORKERS) as executor:
+        for removed, batch_failed in executor.map(remove_s3_batch, batches):
+            for key in removed:
+                logger.info(f"Removed {key} from S3")
+            rtn += removed
+            failed.update(batch_failed)
+    for key, error in failed.items():
+        logger.error(f"Failed to remove {key}: {error}")
+    if failed:
+        logger.error(f"Failed to remove {len(failed)} of {len(objects_to_delete)} objects")
+    listing_cache.invalidate(rtn)
     return rtn
 
 
@@ -347,86 +2034,400 @@ def remove_s3_path(s3_path, api_call=False):
     return remove_s3_objects(s3_objects)
 
 
-def upload_s3_objects(local_files, local_path='./'):
+def abort_journaled_upload(journal_path):
+    """
+    Abort the multipart upload recorded in an upload journal and delete the journal.
+    """
+    try:
+        with open(journal_path, 'r') as f:
+            header, record = (json.loads(line) for line in f.read().splitlines()[:2])
+        get_s3_client().abort_multipart_upload(Bucket=header['bucket'], Key=header['key'], UploadId=record['upload_id'])
+        logger.debug(f"Aborted the unfinished upload of {header['path']} to {header['key']}")
+    except (OSError, ValueError, KeyError, ClientError, BotoCoreError) as e:
+        logger.debug(f"Cannot abort the upload of {journal_path}: {e}")
+    try:
+        os.remove(journal_path)
+    except FileNotFoundError:
+        pass
+
+
+def prune_upload_journals(max_age=S3_UPLOAD_JOURNAL_MAX_AGE):
+    """
+    Abort the uploads whose journal has not been touched for max_age seconds, e.g. of files that were deleted since.
+    """
+    try:
+        entries = list(os.scandir(S3_UPLOAD_JOURNAL_DIR))
+    except OSError:
+        return
+    now = time.time()
+    for entry in entries:
+        try:
+            stale = entry.name.endswith('.json') and now - entry.stat().st_mtime > max_age
+        except OSError:
+            continue
+        if stale:
+            abort_journaled_upload(entry.path)
+
+
+def upload_s3_file_resumable(local_file, s3_key, callback=None):
+    """
+    Upload a large file with a multipart upload whose ID is kept in a journal under S3_UPLOAD_JOURNAL_DIR,
+    so that an interrupted upload resumes with the parts S3 already has. The upload of an older version
+    of the file, or one that failed for good, is aborted.
+
+    :return: Number of bytes of the file
+    """
+    stat = os.stat(local_file)
+    size, chunksize = stat.st_size, S3_MULTIPART_CHUNKSIZE
+    target = {'bucket': S3_BUCKET_NAME, 'key': s3_key, 'path': os.path.abspath(local_file)}
+    header = {**target, 'size': size, 'mtime': stat.st_mtime, 'chunksize': chunksize}
+    # One journal per file and key, so that the upload of a previous version is found and aborted
+    journal_name = hashlib.sha1(json.dumps(target, sort_keys=True).encode('utf-8')).hexdigest() + '.json'
+    journal_path = os.path.join(S3_UPLOAD_JOURNAL_DIR, journal_name)
+    client = get_s3_client()
+
+    parts = {}
+    records = read_journal(journal_path, header)
+    if records is None and os.path.exists(journal_path):
+        abort_journaled_upload(journal_path)
+    upload_id = records[0]['upload_id'] if records else None
+    if upload_id is not None:
+        try:
+            for page in client.get_paginator('list_parts').paginate(Bucket=S3_BUCKET_NAME, Key=s3_key, UploadId=upload_id):
+                for part in page.get('Parts', []):
+                    parts[part['PartNumber']] = part['ETag']
+            logger.info(f"Resuming upload of {local_file}: {len(parts)} parts already uploaded")
+            if callback:
+                callback(min(size, len(parts) * chunksize))
+        except ClientError as e:
+            logger.debug(f"Cannot resume upload of {local_file}: {e}")
+            upload_id = None
+    if upload_id is None:
+        upload_id = client.create_multipart_upload(Bucket=S3_BUCKET_NAME, Key=s3_key)['UploadId']
+        os.makedirs(S3_UPLOAD_JOURNAL_DIR, exist_ok=True)
+        with open(journal_path, 'w') as f:
+            f.write(json.dumps(header) + '\n' + json.dumps({'upload_id': upload_id}) + '\n')
+
+    def upload_part(part_number):
+        start = (part_number - 1) * chunksize
+        with open(local_file, 'rb') as f:
+            body = os.pread(f.fileno(), min(chunksize, size - start), start)
+        response = client.upload_part(Bucket=S3_BUCKET_NAME, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=body)
+        if callback:
+            callback(len(body))
+        return part_number, response['ETag']
+
+    todo = [part_number for part_number in range(1, (size + chunksize - 1) // chunksize + 1) if part_number not in parts]
+    try:
+        with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY) as executor:
+            for future in [executor.submit(upload_part, part_number) for part_number in todo]:
+                part_number, etag = future.result()
+                parts[part_number] = etag
+        client.complete_multipart_upload(
+            Bucket=S3_BUCKET_NAME, Key=s3_key, UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': parts[number]} for number in sorted(parts)]}
+        )
+    except ClientError as e:
+        # Keep the journal to resume after throttling, S3 rejected the upload otherwise
+        if e.response['Error']['Code'] not in S3_RETRYABLE_ERRORS:
+            abort_journaled_upload(journal_path)
+        raise
+    os.remove(journal_path)
+    return size
+
+
+def upload_s3_file(local_file, s3_key, callback=None):
+    """
+    Upload a single local file, return the number of bytes uploaded or None on failure.
+    Files larger than one multipart chunk are uploaded resumably.
+
+    :param callback: Called with the number of bytes of every chunk transferred
+    """
+    try:
+        if os.path.getsize(local_file) > S3_MULTIPART_CHUNKSIZE:
+            num_bytes = upload_s3_file_resumable(local_file, s3_key, callback)
+        else:
+            get_s3_client().upload_file(local_file, S3_BUCKET_NAME, s3_key, Config=get_transfer_config(), Callback=callback)
+            num_bytes = os.path.getsize(local_file)
+        logger.info(f"Uploaded {local_file} to s3://{S3_BUCKET_NAME}/{s3_key}")
+        return num_bytes
+    except (NoCredentialsError, PartialCredentialsError) as e:
+        logger.error(f"Failed to upload {local_file} due to credential issues: {e}")
+    except Exception as e:
+        logger.error(f"Failed to upload {local_file}: {e}")
+
+
+def upload_s3_objects(local_files, local_path='./', workers=None, changed=None, verify=False, manifest=None):
     """
     Upload local files to S3.
 
     :param local_files: List of file paths to upload
     :param local_path: Base path of the local files
+    :param workers: Number of concurrent uploads, default to S3_MAX_WORKERS
+    :param changed: None to skip files that already exist in S3, or 'mtime' / 'md5' to re-upload changed files
+    :param verify: Check the size and ETag of every uploaded object and upload the ones that differ again
+    :param manifest: S3 manifest covering the keys of the files, listed if not given
     :return: List of S3 URLs of the uploaded files
     """
-    rtn = []
+    candidates = []
     for local_file in local_files:
-        if os.path.isfile(local_file):
+        if os.path.isfile(local_file) and not is_partial_file(local_file):
             # Calculate the relative S3 key from the local file path
-            s3_key = os.path.relpath(local_file, os.path.dirname(local_path))
-            s3_key = os.path.normpath(s3_key)
+            s3_key = get_s3_key(local_file, local_path)
+            candidates.append((local_file, s3_key))
+    if not candidates:
+        return []
 
-            # Check if the file already exists in S3
-            response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=s3_key)
-            if 'Contents' in response:
+    if manifest is None:
+        manifest = get_s3_manifest_of_keys([s3_key for _, s3_key in candidates])
+
+    jobs = []
+    for local_file, s3_key in candidates:
+        # Check if the file already exists in S3
+        if s3_key in manifest:
+            if changed is None:
                 logger.warning(f"File {s3_key} already exists in S3")
                 continue
+            if not local_file_changed(local_file, manifest[s3_key], changed):
+                logger.debug(f"File {s3_key} is unchanged in S3")
+                continue
+        jobs.append((local_file, s3_key))
 
-            # Upload the file if it does not exist
-            try:
-                s3_client.upload_file(local_file, S3_BUCKET_NAME, s3_key)
-                uploaded_url = f"s3://{S3_BUCKET_NAME}/{s3_key}"
-                logger.info(f"Uploaded {local_file} to {uploaded_url}")
-                rtn.append(uploaded_url)
-            except (NoCredentialsError, PartialCredentialsError) as e:
-                logger.error(f"Failed to upload {local_file} due to credential issues: {e}")
-            except Exception as e:
-                logger.error(f"Failed to upload {local_file}: {e}")
-
-    return rtn
+    prune_upload_journals()
+    total_bytes = sum(os.path.getsize(local_file) for local_file, _ in jobs)
+    succeeded = run_transfers(
+        jobs, upload_s3_file, workers, operation='upload', total_bytes=total_bytes, verify=verify_upload if verify else None
+    )
+    listing_cache.invalidate([s3_key for _, s3_key in jobs])
+    return [f"s3://{S3_BUCKET_NAME}/{s3_key}" for _, s3_key in succeeded]
 
 
-def upload_s3_path(s3_path, local_path='./', api_call=False):
+def upload_s3_path(s3_path, local_path='./', api_call=False, changed=None, verify=False):
     """
     Upload all files in the local path to the S3 path.
+
+    :param changed: None to skip files that already exist in S3, or 'mtime' / 'md5' to re-upload changed files
+    :param verify: Check the size and ETag of every uploaded object and upload the ones that differ again
     """
     if api_call:
         if api_server_online():
             logger.debug(f"API server is online. Sending request to upload {s3_path}...")
-            return send_request("upload", s3_path)['message']
+            return send_request("upload", s3_path, changed=changed, verify=verify)['message']
         else:
             logger.debug("API server is not online. Falling back to local implementation.")
     
     # Remove the trailing '*' 
     s3_path = s3_path.rstrip('*')
     s3_path = os.path.normpath(s3_path)
-    s3_objects = get_s3_objects(s3_path)
-    local_files = get_local_files(s3_path, local_path)
+    manifest = get_s3_manifest(s3_path)
+    # Unfinished downloads are never uploaded
+    local_files = [file for file in get_local_files(s3_path, local_path) if not is_partial_file(file)]
     
-    # Skip files that already exist in S3
-    local_files = [file for file in local_files if not any(file == s3_key for s3_key in s3_objects)]
+    # Skip files that already exist in S3, unless they are compared for changes later
+    if changed is None:
+        local_keys = {get_s3_key(file, local_path): file for file in local_files}
+        added, _, _ = diff_trees(list(local_keys), manifest)
+        local_files = [local_keys[s3_key] for s3_key in added]
     
     if len(local_files) == 0:
         logger.error(f"No new files found in {s3_path}")
         return []
     
     if use_s5cmd():
+        uploaded_keys = [get_s3_key(file, local_path) for file in local_files]
+        # Either never overwrite, or overwrite when the size differs or the local file is newer
+        flags = "-n" if changed is None else "-s -u"
         # Single file or directory
         if '*' not in s3_path and os.path.exists(os.path.join(local_path, s3_path)):
             s3_path = s3_path.rstrip('/')
-            local_path = os.path.join(local_path, s3_path)
-            if os.path.isdir(local_path):
-                local_path += os.sep
+            source = os.path.join(local_path, s3_path)
+            if os.path.isdir(source):
+                source += os.sep
                 s3_path += '/'
-            dest = os.path.join(local_path, s3_path)
-            run_s5cmd(f"s5cmd cp -n --sp {local_path} s3://{S3_BUCKET_NAME}/{s3_path}")
-        else:  # Upload one by one
-            commands = ""
-            for s3_key in local_files:
-                dest = f"s3://{S3_BUCKET_NAME}/{s3_key}"
-                s5cmd_command = f"s5cmd cp -n --sp {s3_key} {dest}"
-                commands += s5cmd_command + " && "
-            commands = commands[:-4]
-            run_s5cmd(commands)
+                flags += f' --exclude "*{S3_PART_SUFFIX}*"'
+            commands = [f'cp {flags} "{source}" "s3://{S3_BUCKET_NAME}/{s3_path}"']
+        else:  # Upload file by file in a single s5cmd process
+            commands = [
+                f'cp {flags} "{file}" "s3://{S3_BUCKET_NAME}/{s3_key}"'
+                for file, s3_key in zip(local_files, uploaded_keys)
+            ]
+        total_bytes = sum(os.path.getsize(file) for file in local_files)
+        succeeded, _ = run_s5cmd_batch(commands, operation='upload', total_bytes=total_bytes)
+        destinations = {result['destination'] for result in succeeded}
+        local_files = [
+            file for file, s3_key in zip(local_files, uploaded_keys)
+            if f"s3://{S3_BUCKET_NAME}/{s3_key}" in destinations
+        ]
+        listing_cache.invalidate(uploaded_keys)
+        if verify:
+            local_files = verify_s5cmd_uploads(local_files, local_path)
         return local_files
     else:
-        return upload_s3_objects(local_files, local_path)
+        return upload_s3_objects(local_files, local_path, changed=changed, verify=verify, manifest=manifest)
+
+
+def verify_s5cmd_uploads(local_files, local_path):
+    """
+    Verify objects uploaded by s5cmd and upload the ones that differ again, return the local files that passed.
+    Only the files uploaded again are verified a second time.
+    """
+    s3_keys = {local_file: get_s3_key(local_file, local_path) for local_file in local_files}
+
+    def failed_files(files):
+        if not files:
+            return []
+        manifest = get_s3_manifest_of_keys([s3_keys[local_file] for local_file in files])
+        failed = verify_files([(local_file, manifest.get(s3_keys[local_file]), s3_keys[local_file]) for local_file in files])
+        for local_file, _, _ in failed:
+            logger.warning(f"s3://{S3_BUCKET_NAME}/{s3_keys[local_file]} failed verification")
+        return [local_file for local_file, _, _ in failed]
+
+    failed = failed_files(list(local_files))
+    if failed:
+        commands = [f'cp "{local_file}" "s3://{S3_BUCKET_NAME}/{s3_keys[local_file]}"' for local_file in failed]
+        run_s5cmd_batch(commands, operation='upload', total_bytes=sum(os.path.getsize(local_file) for local_file in failed))
+        listing_cache.invalidate([s3_keys[local_file] for local_file in failed])
+        failed = failed_files(failed)
+        if failed:
+            logger.error(f"{len(failed)} files failed verification again")
+    failed = set(failed)
+    return [local_file for local_file in local_files if local_file not in failed]
+
+
+def get_local_manifest(local_files, local_path='./'):
+    """
+    Index local files by their S3 key.
+
+    :param local_files: Iterable of paths, or of (path, stat_result) tuples to skip the stat calls
+    :return: Dict mapping S3 key to {'size', 'mtime', 'path'}
+    """
+    manifest = {}
+    for local_file in local_files:
+        local_file, stat = local_file if isinstance(local_file, tuple) else (local_file, None)
+        if is_partial_file(local_file):
+            continue
+        stat = stat or os.stat(local_file)
+        manifest[get_s3_key(local_file, local_path)] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'path': local_file}
+    return manifest
+
+
+def same_content(local_meta, remote_meta):
+    """
+    Compare a local file and an S3 object of equal size by their ETags.
+    """
+    return etag_matches(local_meta['path'], remote_meta['etag']) is True
+
+
+def same_contents(pairs, workers=None):
+    """
+    same_content for many files in parallel, as hashlib releases the GIL while hashing.
+
+    :param pairs: List of (local_meta, remote_meta) tuples
+    :return: List of booleans
+    """
+    if not pairs:
+        return []
+    with ThreadPoolExecutor(max_workers=workers or S3_MAX_WORKERS) as executor:
+        return list(executor.map(lambda pair: same_content(*pair), pairs))
+
+
+def sync_s3_path(s3_path, local_path='./', direction='download', delete=False, api_call=False, verify=False):
+    """
+    Synchronize the S3 path with the local path, only transferring files that differ in size, mtime or ETag.
+
+    :param direction: 'download' mirrors S3 to local, 'upload' mirrors local to S3,
+                      'both' copies missing files both ways and the newer version of changed files
+    :param delete: Delete files that are missing on the source side, ignored when direction is 'both'
+    :param verify: Check the size and ETag of every transferred file and transfer the ones that differ again
+    :return: Dict of downloaded, uploaded, deleted (local) and removed (S3) files
+    """
+    if api_call:
+        if api_server_online():
+            logger.debug(f"API server is online. Sending request to sync {s3_path}...")
+            return send_request("sync", s3_path, direction=direction, delete=delete, verify=verify)['message']
+        else:
+            logger.debug("API server is not online. Falling back to local implementation.")
+
+    # Remove the trailing '*'
+    s3_path = s3_path.rstrip('*')
+    s3_path = os.path.normpath(s3_path)
+    remote = get_s3_manifest(s3_path)
+    local = get_local_manifest(iter_local_files(s3_path, local_path, with_stat=True), local_path)
+
+    def changed(key, local_meta, remote_meta):
+        if local_meta['size'] != remote_meta['size']:
+            return True
+        # Downloads inherit the S3 mtime, so equal timestamps mean the files are in sync
+        if abs(local_meta['mtime'] - remote_meta['mtime']) < 1:
+            return False
+        # Uploads are stamped after the local file was written
+        if direction == 'upload' and remote_meta['mtime'] > local_meta['mtime']:
+            return False
+        # Same size but different mtimes, the contents are compared in parallel below
+        ambiguous.append(key)
+        return False
+
+    ambiguous = []
+    only_local, modified, only_remote = diff_trees(local, remote, changed)
+    for key, same in zip(ambiguous, same_contents([(local[key], remote[key]) for key in ambiguous])):
+        if not same:
+            modified.append(key)
+            continue
+        # Take the S3 mtime, so that the next sync compares the timestamps instead of hashing the file again
+        try:
+            os.utime(local[key]['path'], (remote[key]['mtime'], remote[key]['mtime']))
+        except OSError as e:
+            logger.debug(f"Cannot set the mtime of {local[key]['path']}: {e}")
+    to_download, to_upload = [], []
+    if direction in ('download', 'both'):
+        to_download += only_remote
+    if direction in ('upload', 'both'):
+        to_upload += only_local
+    for key in modified:
+        if direction == 'download' or (direction == 'both' and remote[key]['mtime'] > local[key]['mtime']):
+            to_download.append(key)
+        else:
+            to_upload.append(key)
+    logger.info(
+        f"Sync {s3_path}: {len(only_local)} only local, {len(only_remote)} only in S3, {len(modified)} changed, "
+        f"{len(to_download)} to download, {len(to_upload)} to upload"
+    )
+
+    def download_and_touch(s3_key, local_file_path, callback=None):
+        num_bytes = download_s3_file(s3_key, local_file_path, callback, remote[s3_key])
+        if num_bytes is not None:
+            os.utime(local_file_path, (remote[s3_key]['mtime'], remote[s3_key]['mtime']))
+        return num_bytes
+
+    jobs = []
+    for s3_key in to_download:
+        local_file_path = os.path.join(local_path, s3_key)
+        os.makedirs(os.path.dirname(local_file_path) or '.', exist_ok=True)
+        jobs.append((s3_key, local_file_path))
+    total_bytes = sum(remote[s3_key]['size'] for s3_key in to_download)
+    succeeded = run_transfers(
+        jobs, download_and_touch, operation='download', total_bytes=total_bytes,
+        verify=(lambda s3_key, local_file_path: verify_download(s3_key, local_file_path, remote[s3_key])) if verify else None
+    )
+    object_cache.evict()
+    downloaded = [os.path.normpath(local_file_path) for _, local_file_path in succeeded]
+
+    jobs = [(local[s3_key]['path'], s3_key) for s3_key in to_upload]
+    if jobs:
+        prune_upload_journals()
+    total_bytes = sum(local[s3_key]['size'] for s3_key in to_upload)
+    succeeded = run_transfers(
+        jobs, upload_s3_file, operation='upload', total_bytes=total_bytes, verify=verify_upload if verify else None
+    )
+    listing_cache.invalidate([s3_key for _, s3_key in jobs])
+    uploaded = [f"s3://{S3_BUCKET_NAME}/{s3_key}" for _, s3_key in succeeded]
+
+    deleted, removed = [], []
+    if delete and direction == 'download' and only_local:
+        deleted = delete_local_files([local[s3_key]['path'] for s3_key in only_local], root=local_path)
+    elif delete and direction == 'upload' and only_remote:
+        removed = remove_s3_objects(only_remote)
+    return {'downloaded': downloaded, 'uploaded': uploaded, 'deleted': deleted, 'removed': removed}
 
 
 def interactive_list_and_action(s3_path, local_path):
@@ -463,7 +2464,7 @@ def interactive_list_and_action(s3_path, local_path):
 
     action = input("\nChoose an action [delete (local), remove (S3), download, upload, exit]: ").strip().lower()
     if action == "delete":
-        delete_local_files(local_files)
+        delete_local_files(local_files, root=local_path)
     elif action == "upload":
         upload_s3_objects(local_files, local_path)
     elif action == "remove":
@@ -486,55 +2487,642 @@ def list_files(directory):
             yield Path(root) / file
 
 
-def monitor(folder_path, interval, log_file="monitor.log"):
+class InotifyWatcher():
+    """
+    Recursive inotify watcher (Linux only) over the non-hidden directories of a folder.
+    """
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, folder_path):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not supported on this platform")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # Watch descriptor -> directory
+        self.add_tree(Path(folder_path))
+
+    def add_tree(self, directory):
+        """
+        Watch the directory and its non-hidden subdirectories, return the files already inside.
+        """
+        files = []
+        for root, dirs, filenames in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.WATCH_MASK)
+            if wd < 0:
+                logger.warning(f"Cannot watch {root}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self.watches[wd] = Path(root)
+            files += [Path(root) / f for f in filenames if not f.startswith('.')]
+        return files
+
+    def remove_tree(self, directory):
+        """
+        Stop watching the directory and its subdirectories, e.g. after it was moved out of the folder.
+        """
+        for wd, path in list(self.watches.items()):
+            if path == directory or directory in path.parents:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def read_events(self, timeout):
+        """
+        Wait at most timeout seconds and return the pending events as (mask, path) tuples.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buffer = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif mask & self.IN_Q_OVERFLOW:
+                events.append((mask, None))
+            elif wd in self.watches and not name.startswith('.'):
+                events.append((mask, self.watches[wd] / name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def file_signature(file):
+    try:
+        stat = file.stat()
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+
+def monitor_inotify(folder_path, upload, remove, debounce=1.0, remove_folder=None):
+    """
+    Upload files as soon as they are closed after writing or moved in, and remove deleted files.
+    Files are uploaded once no event has been seen on them for `debounce` seconds, to absorb bursts of writes.
+    Files found by a scan (new directory, queue overflow) may still be open for writing, so they are only uploaded
+    once their size and mtime have not changed for `debounce` seconds.
+
+    :param remove_folder: Called with a directory deleted or moved out of the folder, default to nothing
+    """
+    watcher = InotifyWatcher(folder_path)
+    logger.info(f"Watching {folder_path} with inotify")
+    pending = {}  # File -> time of the last event
+    scanned = {}  # File found by a scan -> (size, mtime) when last checked
+
+    def scan(files, now):
+        for file in files:
+            pending[file] = now
+            scanned[file] = file_signature(file)
+
+    try:
+        while True:
+            for mask, path in watcher.read_events(debounce):
+                now = time.time()
+                if path is None:
+                    # Events were dropped, rescan everything
+                    logger.warning("inotify queue overflowed, rescanning")
+                    scan(list_files(folder_path), now)
+                elif mask & watcher.IN_ISDIR:
+                    if mask & (watcher.IN_CREATE | watcher.IN_MOVED_TO):
+                        # Files may have been written before the new directory was watched
+                        scan(watcher.add_tree(path), now)
+                    elif mask & (watcher.IN_DELETE | watcher.IN_MOVED_FROM):
+                        for file in [file for file in pending if path in file.parents]:
+                            pending.pop(file)
+                            scanned.pop(file, None)
+                        watcher.remove_tree(path)
+                        if remove_folder is not None:
+                            remove_folder(path)
+                elif mask & (watcher.IN_CLOSE_WRITE | watcher.IN_MOVED_TO):
+                    pending[path] = now
+                    scanned.pop(path, None)
+                elif mask & watcher.IN_MODIFY:
+                    # Still being written, wait for the writer to close it or stop writing
+                    if path in pending:
+                        pending[path] = now
+                elif mask & (watcher.IN_DELETE | watcher.IN_MOVED_FROM):
+                    pending.pop(path, None)
+                    scanned.pop(path, None)
+                    remove(path)
+
+            now = time.time()
+            for file, last_event in list(pending.items()):
+                if now - last_event < debounce:
+                    continue
+                if file in scanned:
+                    signature = file_signature(file)
+                    if signature != scanned[file]:
+                        pending[file] = now
+                        scanned[file] = signature
+                        continue
+                    del scanned[file]
+                del pending[file]
+                if file.is_file():
+                    upload(file)
+    finally:
+        watcher.close()
+
+
+def monitor_polling(folder_path, upload, remove, interval):
+    """
+    Re-walk the folder every `interval` seconds, upload files that have not been modified for `interval` seconds
+    and remove deleted files.
+    """
+    # Initial check for existing files
+    last_seen_files = set(list_files(folder_path))
+    logger.debug(f"Initial files: {last_seen_files}")
+
+    added_files = set()
+    while True:
+        time.sleep(interval)
+        current_files = set(list_files(folder_path))
+        added_files.update(current_files - last_seen_files)
+        removed_files = last_seen_files - current_files
+
+        for file in added_files.copy():
+            # Check if the file has not been modified for at least 'interval' seconds
+            logger.debug(f"New file detected: {file}")
+            logger.debug(f"Time since last modification: {(time.time() - os.path.getmtime(file)):.5f}")
+            if time.time() - os.path.getmtime(file) > interval:
+                logger.info(f"New file detected and stable: {file}")
+                added_files.remove(file)
+                upload(file)
+
+        for file in removed_files:
+            remove(file)
+
+        last_seen_files = current_files
+
+
+class RetentionPolicy():
+    """
+    Retention rules for monitor. Files matching an ignore pattern are never uploaded, and after uploads of files
+    matching a keep-last or keep-best rule, the S3 objects matching these rules are pruned to the ones retained by
+    any of their rules. Patterns are matched against paths relative to the monitored folder.
+
+    :param ignore: Glob patterns of files never uploaded, default to common temporary files
+    :param keep_last: Dict mapping a glob to the number of most recent matching objects to keep
+    :param keep_best: List of (glob, metric, n, mode) tuples keeping the n matching objects with the lowest
+                      (mode 'min') or highest (mode 'max') metric parsed from the filename, e.g. val_loss=0.123
+    """
+    apply_delay = 5.0  # Seconds between an upload and the pruning, so that a burst of uploads costs one listing
+    DEFAULT_IGNORE = ['*.tmp', '*.partial', '*.part', '*.swp', '*~', '*' + S3_PART_SUFFIX, '*' + S3_PART_SUFFIX + '.json']
+
+    def __init__(self, ignore=None, keep_last=None, keep_best=None):
+        self.ignore = self.DEFAULT_IGNORE if ignore is None else ignore
+        self.keep_last = keep_last or {}
+        self.keep_best = keep_best or []
+        self.lock = threading.Lock()
+        self.apply_lock = threading.Lock()
+        self.uploads = {}  # Key -> upload sequence number, to order objects with the same LastModified
+        self.upload_sequence = itertools.count()
+        self.scheduled = set()  # Prefixes to prune when the timer fires
+        self.timer = None
+
+    @classmethod
+    def from_args(cls, ignore=None, keep_last=None, keep_best=None):
+        """
+        Parse command line rules: keep_last as 'GLOB=N', keep_best as 'GLOB=METRIC:N[:min|max]'.
+        """
+        keep_last_rules = {}
+        for rule in keep_last or []:
+            pattern, n = rule.rsplit('=', 1)
+            keep_last_rules[pattern] = int(n)
+        keep_best_rules = []
+        for rule in keep_best or []:
+            pattern, spec = rule.rsplit('=', 1)
+            metric, n, *mode = spec.split(':')
+            mode = mode[0] if mode else 'min'
+            assert mode in ('min', 'max'), f"Invalid keep_best mode {mode}"
+            keep_best_rules.append((pattern, metric, int(n), mode))
+        return cls(ignore, keep_last_rules, keep_best_rules)
+
+    def has_rules(self):
+        return bool(self.keep_last or self.keep_best)
+
+    def ignored(self, relative_path):
+        return any(fnmatch.fnmatch(relative_path, pattern) for pattern in self.ignore)
+
+    def governs(self, relative_path):
+        patterns = list(self.keep_last) + [pattern for pattern, *_ in self.keep_best]
+        return any(fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+    @staticmethod
+    def metric_value(key, metric):
+        match = re.search(
+            rf"{re.escape(metric)}[=_:-]?(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)", os.path.basename(key)
+        )
+        return float(match.group(1)) if match else None
+
+    def evictions(self, manifest, prefix=''):
+        """
+        Return the keys of the manifest that match a rule but are retained by none of their rules.
+        LastModified often has a one-second resolution, so keep-last breaks ties by the order of the uploads
+        recorded with record_upload, then by key.
+
+        >>> policy = RetentionPolicy(keep_last={'epoch*.ckpt': 2})
+        >>> for i in (8, 9, 10, 11): policy.record_upload(f'ckpt/epoch{i}.ckpt')
+        >>> manifest = {f'ckpt/epoch{i}.ckpt': {'mtime': 100.0} for i in (8, 9, 10, 11)}
+        >>> policy.evictions(manifest, 'ckpt/')
+        ['ckpt/epoch8.ckpt', 'ckpt/epoch9.ckpt']
+        """
+        with self.lock:
+            uploads = dict(self.uploads)
+        governed, kept = set(), set()
+        for pattern, n in self.keep_last.items():
+            matching = [key for key in manifest if fnmatch.fnmatch(key[len(prefix):], pattern)]
+            governed.update(matching)
+            kept.update(sorted(matching, key=lambda key: (manifest[key]['mtime'], uploads.get(key, -1), key), reverse=True)[:n])
+        for pattern, metric, n, mode in self.keep_best:
+            matching = [key for key in manifest if fnmatch.fnmatch(key[len(prefix):], pattern)]
+            governed.update(matching)
+            scored = [(self.metric_value(key, metric), key) for key in matching]
+            # Objects without the metric in their name are never evicted by this rule
+            kept.update(key for value, key in scored if value is None)
+            scored = sorted(((value, key) for value, key in scored if value is not None), reverse=(mode == 'max'))
+            kept.update(key for _, key in scored[:n])
+        return sorted(governed - kept)
+
+    def apply(self, prefix):
+        """
+        Remove the S3 objects under the prefix that are no longer retained.
+        """
+        if not self.has_rules():
+            return []
+        with self.apply_lock:
+            evicted = self.evictions(get_s3_manifest(prefix), prefix)
+            if evicted:
+                logger.info(f"Retention policy evicts {len(evicted)} objects under {prefix}")
+                remove_s3_objects(evicted)
+                with self.lock:
+                    for key in evicted:
+                        self.uploads.pop(key, None)
+        return evicted
+
+    def record_upload(self, key):
+        with self.lock:
+            self.uploads[key] = next(self.upload_sequence)
+
+    def schedule(self, prefix, relative_path):
+        """
+        Prune the prefix apply_delay seconds from now, if the uploaded file matches a rule.
+        Uploads made in the meantime are pruned by the same run.
+        """
+        if not self.governs(relative_path):
+            return
+        self.record_upload(prefix + relative_path)
+        with self.lock:
+            self.scheduled.add(prefix)
+            if self.timer is None:
+                self.timer = threading.Timer(self.apply_delay, self.apply_scheduled)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def apply_scheduled(self):
+        with self.lock:
+            prefixes, self.scheduled, self.timer = self.scheduled, set(), None
+        for prefix in prefixes:
+            try:
+                self.apply(prefix)
+            except Exception as e:
+                logger.error(f"Failed to apply the retention policy to {prefix}: {e}")
+
+
+class UploadQueue():
+    """
+    Bounded queue of monitor operations ('upload' or 'remove' per file) served by a pool of worker threads,
+    so that detection never waits on transfers. Operations on the same file are coalesced, the latest wins,
+    and operations on one file never run concurrently. Changes are appended to a JSON lines journal, outside the
+    queue lock, and replayed after a restart. put() blocks while the queue is full.
+    """
+    compact_min_records = 1000  # Rewrite the journal once it has this many records and 4 times more than operations
+
+    def __init__(self, path, handlers, workers=4, maxsize=10000):
+        self.path = Path(path)
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.pending = OrderedDict()  # File -> operation, not started yet
+        self.running = {}  # File -> operation, in progress
+        self.condition = threading.Condition()
+        self.records = []  # Journal records not written yet
+        self.journal_lock = threading.Lock()
+        self.journal = None
+        self.journal_records = 0
+        if self.path.exists():
+            for file, operation in self.load().items():
+                self.pending[Path(file)] = operation
+            if self.pending:
+                logger.info(f"Resuming {len(self.pending)} queued operations from {self.path}")
+        with self.journal_lock:
+            self.compact()
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def load(self):
+        operations = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Cut short by a crash
+                    if isinstance(record, list) and len(record) == 2:
+                        file, operation = record
+                        operations.pop(file, None)
+                        if operation is not None:
+                            operations[file] = operation
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable queue {self.path}: {e}")
+        return operations
+
+    def record(self, file):
+        # Called with the condition held: the state of the file is its pending operation, or the one in progress
+        self.records.append((str(file), self.pending.get(file, self.running.get(file))))
+
+    def save(self):
+        """
+        Append the new records to the journal, and compact it when most of its records are obsolete.
+        """
+        with self.journal_lock:
+            with self.condition:
+                records, self.records = self.records, []
+                operations = len(self.pending) + len(self.running)
+            if records:
+                self.journal.write(''.join(json.dumps(record) + '\n' for record in records))
+                self.journal.flush()
+                self.journal_records += len(records)
+            if self.journal_records >= max(self.compact_min_records, 4 * operations):
+                self.compact()
+
+    def compact(self):
+        """
+        Rewrite the journal with one record per queued operation, called with journal_lock held.
+        """
+        with self.condition:
+            # Operations in progress are saved too, so they are retried if the process dies
+            operations = [(str(file), operation) for file, operation in {**self.running, **self.pending}.items()]
+            self.records = []
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in operations))
+        os.replace(tmp_path, self.path)
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.path, 'a')
+        self.journal_records = len(operations)
+
+    def put(self, file, operation):
+        with self.condition:
+            while len(self.pending) >= self.maxsize and file not in self.pending:
+                logger.warning(f"Upload queue is full ({self.maxsize}), waiting")
+                self.condition.wait()
+            self.pending[file] = operation
+            self.record(file)
+            self.condition.notify_all()
+        self.save()
+
+    def next_operation(self):
+        for file, operation in self.pending.items():
+            if file not in self.running:
+                return file, operation
+        return None
+
+    def work(self):
+        while True:
+            with self.condition:
+                while (item := self.next_operation()) is None:
+                    self.condition.wait()
+                file, operation = item
+                del self.pending[file]
+                self.running[file] = operation
+                self.condition.notify_all()
+            try:
+                self.handlers[operation](file)
+            except Exception as e:
+                logger.error(f"Failed to {operation} {file}: {e}")
+            finally:
+                with self.condition:
+                    del self.running[file]
+                    self.record(file)
+                    self.condition.notify_all()
+                self.save()
+
+
+def monitor(
+    folder_path, interval, log_file="monitor.log", backend="auto", debounce=1.0, workers=4, queue_size=10000,
+    retention=None
+):
+    """
+    Mirror a local folder to S3, uploading new files and removing deleted ones.
+
+    :param interval: Polling interval in seconds, for the polling backend
+    :param backend: 'inotify', 'polling', or 'auto' to use inotify when available
+    :param debounce: Seconds without events before a closed file is uploaded, for the inotify backend
+    :param workers: Number of uploads / removals processed concurrently
+    :param queue_size: Maximum number of queued operations before detection waits for the workers
+    :param retention: RetentionPolicy deciding what is uploaded and kept, default to skipping temporary files
+    """
+    retention = retention or RetentionPolicy()
     # Log to monitor.log by default
     logger.add(log_file, rotation="1 week")
     
     # Convert the relative path to an absolute path
     folder_path = Path(folder_path).resolve()
     lock_path = folder_path / ".monitor.lock"
+
+    def upload(file):
+        if not file.is_file():
+            logger.debug(f"Skipping upload of {file}, it no longer exists")
+            return
+        file_path = file.relative_to(Path.cwd())
+        # Overwrite the object if the file changed since, e.g. it was uploaded while still being written
+        upload_s3_path(str(file_path), changed='mtime')
+        logger.info(f"File uploaded: s3://{S3_BUCKET_NAME}/{file_path}")
+        retention.schedule(str(folder_path.relative_to(Path.cwd())) + '/', str(file.relative_to(folder_path)))
+
+    def remove(file):
+        file_path = file.relative_to(Path.cwd())
+        logger.info(f"File removed: {file_path}")
+        # Remove the exact key, a prefix would also match e.g. epoch10.ckpt for epoch1.ckpt
+        remove_s3_objects([str(file_path)])
+
+    def remove_folder(folder):
+        prefix = str(folder.relative_to(Path.cwd())) + '/'
+        removed = remove_s3_objects(get_s3_objects(prefix))
+        logger.info(f"Folder removed: {prefix} ({len(removed)} files)")
     
     try:
         acquire_lock(lock_path)
+        handlers = {'upload': upload, 'remove': remove, 'remove_folder': remove_folder}
+        queue = UploadQueue(folder_path / ".monitor.queue", handlers, workers, queue_size)
+
+        def enqueue_upload(file):
+            if retention.ignored(str(file.relative_to(folder_path))):
+                logger.debug(f"Ignoring {file}")
+                return
+            queue.put(file, 'upload')
+
+        def enqueue_remove(file):
+            if retention.ignored(str(file.relative_to(folder_path))):
+                return
+            queue.put(file, 'remove')
+
+        def enqueue_remove_folder(folder):
+            queue.put(folder, 'remove_folder')
         
-        # Initial check for existing files
-        last_seen_files = set(list_files(folder_path))
-        logger.debug(f"Initial files: {last_seen_files}")
-
-        added_files = set()
-        while True:
-            time.sleep(interval)
-            current_files = set(list_files(folder_path))
-            added_files.update(current_files - last_seen_files)
-            removed_files = last_seen_files - current_files
-
-            for file in added_files.copy():
-                # Check if the file has not been modified for at least 'interval' seconds
-                file_path = folder_path / file
-                file_path = file_path.relative_to(Path.cwd())
-                
-                logger.debug(f"New file detected: {file_path}")
-                logger.debug(f"Time since last modification: {(time.time() - os.path.getmtime(file_path)):.5f}")
-                if time.time() - os.path.getmtime(file_path) > interval:
-                    logger.info(f"New file detected and stable: {file}")
-                    added_files.remove(file)
-                    upload_s3_path(file_path)
-                    logger.info(f"File uploaded: s3://{S3_BUCKET_NAME}/{file_path}")
-
-            for file in removed_files:
-                file_path = folder_path / file
-                file_path = file_path.relative_to(Path.cwd())
-                
-                logger.info(f"File removed: {file_path}")
-                remove_s3_path(file_path)
-
-            last_seen_files = current_files
+        if backend in ("auto", "inotify"):
+            try:
+                monitor_inotify(folder_path, enqueue_upload, enqueue_remove, debounce, enqueue_remove_folder)
+                return
+            except OSError as e:
+                if backend == "inotify":
+                    raise
+                logger.warning(f"inotify is unavailable ({e}), falling back to polling every {interval}s")
+        monitor_polling(folder_path, enqueue_upload, enqueue_remove, interval)
 
     finally:
         release_lock(lock_path)
         
 
-class TimedHTTPServer(HTTPServer):
+class JobManager():
+    """
+    Runs long API server operations (transfers, removals) as background jobs on a bounded pool,
+    so that they never hold up the threads answering metadata requests.
+    Finished jobs are kept for `retention` seconds for status polling.
+    """
+    def __init__(self, workers=4, retention=3600):
+        self.workers = workers
+        self.retention = retention
+        self.executor = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, command, path, fn, options=None):
+        """
+        Submit a job, or return the unfinished job running the same command with the same path and options,
+        so that concurrent identical requests share a single transfer.
+        """
+        def run_job(job):
+            with self.lock:
+                job['status'] = 'running'
+            try:
+                result = fn()
+            except Exception as e:
+                logger.error(f"Job {job['id']} ({command} {path}) failed: {e}")
+                with self.lock:
+                    job.update(error=str(e), status='failed', finished=time.time())
+                raise
+            with self.lock:
+                job.update(result=result, status='done', finished=time.time())
+            return result
+
+        with self.lock:
+            for job in self.jobs.values():
+                if job['finished'] is None and (job['command'], job['path'], job['options']) == (command, path, options):
+                    logger.debug(f"Joining job {job['id']}: {command} {path}")
+                    return job
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            now = time.time()
+            for job_id in [job_id for job_id, job in self.jobs.items() if job['finished'] and now - job['finished'] > self.retention]:
+                del self.jobs[job_id]
+            job = {
+                'id': uuid.uuid4().hex, 'command': command, 'path': path, 'options': options,
+                'status': 'queued', 'submitted': now, 'finished': None, 'result': None, 'error': None
+            }
+            self.jobs[job['id']] = job
+            job['future'] = self.executor.submit(run_job, job)
+        logger.debug(f"Job {job['id']} submitted: {command} {path}")
+        return job
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return {'id': job_id, 'status': 'unknown'}
+            return {key: value for key, value in job.items() if key != 'future'}
+
+    def running(self):
+        with self.lock:
+            return any(job['finished'] is None for job in self.jobs.values())
+
+
+api_jobs = JobManager()
+
+
+class ServerCache():
+    """
+    In-memory LRU cache with TTL for the API server's metadata requests, shared by all clients.
+    Concurrent identical requests are deduplicated: the first computes the result and the others wait for it.
+    """
+    def __init__(self, maxsize=API_CACHE_SIZE, ttl=API_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> (time, value)
+        self.inflight = {}  # Key -> Future
+        self.lock = threading.Lock()
+
+    def get(self, key, fn):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                return entry[1]
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            value = fn()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+        if self.ttl > 0:
+            with self.lock:
+                self.entries[key] = (time.time(), value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+api_cache = ServerCache()
+
+
+class TimedHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
     def __init__(self, server_address, RequestHandlerClass, initial_timeout, idle_timeout):
         super().__init__(server_address, RequestHandlerClass)
         self.initial_timeout = initial_timeout
@@ -542,27 +3130,33 @@ class TimedHTTPServer(HTTPServer):
         self.start_time = time.time()
         self.last_request_time = None
         self.shutdown_timer = None
+        self.timer_lock = threading.Lock()  # Requests are handled concurrently
         self.start_shutdown_timer()
 
     def start_shutdown_timer(self):
-        if self.shutdown_timer:
-            self.shutdown_timer.cancel()
-        
-        current_time = time.time()
-        
-        if self.last_request_time is None:
-            # We're still waiting for the first request
-            next_check = self.start_time + self.initial_timeout - current_time
-        else:
-            # We've received at least one request, use the idle timeout
-            next_check = self.idle_timeout
-        
-        self.shutdown_timer = threading.Timer(next_check, self.check_idle)
-        self.shutdown_timer.start()
+        with self.timer_lock:
+            if self.shutdown_timer:
+                self.shutdown_timer.cancel()
+            
+            current_time = time.time()
+            
+            if self.last_request_time is None:
+                # We're still waiting for the first request
+                next_check = self.start_time + self.initial_timeout - current_time
+            else:
+                # We've received at least one request, check again once the idle timeout has passed since the last
+                next_check = max(0, self.last_request_time + self.idle_timeout - current_time)
+            
+            self.shutdown_timer = threading.Timer(next_check, self.check_idle)
+            self.shutdown_timer.start()
 
     def check_idle(self):
         current_time = time.time()
-        if self.last_request_time is None:
+        if api_jobs.running():
+            # Background jobs count as activity
+            self.last_request_time = current_time
+            self.start_shutdown_timer()
+        elif self.last_request_time is None:
             # No requests received within initial timeout
             if current_time - self.start_time >= self.initial_timeout:
                 logger.info("No initial request received within the specified time. Shutting down.")
@@ -576,11 +3170,44 @@ class TimedHTTPServer(HTTPServer):
             self.start_shutdown_timer()
             
     def update_last_request_time(self):
+        # The running timer picks up the new time when it fires, so requests don't have to restart it
+        first_request = self.last_request_time is None
         self.last_request_time = time.time()
-        self.start_shutdown_timer()
+        if first_request:
+            self.start_shutdown_timer()
+
+
+class UnixHTTPServer(TimedHTTPServer):
+    """
+    API server listening on a Unix socket, which skips the TCP stack for clients on the same node.
+    """
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                if s.connect_ex(self.server_address) == 0:
+                    raise OSError(98, f"{self.server_address} is already in use")
+            os.unlink(self.server_address)  # Stale socket
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+        self.bound = True
+
+    def server_close(self):
+        super().server_close()
+        if getattr(self, 'bound', False) and os.path.exists(self.server_address):
+            os.unlink(self.server_address)
 
 
 class RequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive between requests
+    wbufsize = -1  # Write headers and body together, delayed ACKs would stall a separate body write
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
     def do_POST(self):
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
@@ -589,16 +3216,45 @@ class RequestHandler(SimpleHTTPRequestHandler):
         command = data.get('command')
         path = data.get('path')
         
+        if isinstance(self.server, TimedHTTPServer):
+            self.server.update_last_request_time()
+
+        # Long operations run as jobs, so they only occupy this request's thread while it waits
+        jobs = {
+            'download': lambda: download_s3_path(path, verify=data.get('verify', False)),
+            'upload': lambda: upload_s3_path(path, changed=data.get('changed'), verify=data.get('verify', False)),
+            'remove': lambda: remove_s3_path(path),
+            'sync': lambda: sync_s3_path(
+                path, direction=data.get('direction', 'download'), delete=data.get('delete', False), verify=data.get('verify', False)
+            ),
+        }
+        options = {key: data.get(key) for key in ('direction', 'delete', 'changed', 'verify') if key in data} or None
+
+        def modify_s3(fn):
+            # Cached listings may be stale once S3 is modified
+            def wrapper():
+                try:
+                    return fn()
+                finally:
+                    api_cache.clear()
+            return wrapper
+        
         if command == 'find':
-            response = get_s3_objects(path)
+            response = api_cache.get(('find', path, data.get('limit')), lambda: get_s3_objects(path, limit=data.get('limit')))
         elif command == 'list':
-            response = list_s3_objects(path)
-        elif command == 'download':
-            response = download_s3_path(path)
-        elif command == 'upload':
-            response = upload_s3_path(path)
-        elif command == 'remove':
-            response = remove_s3_path(path)
+            response = api_cache.get(('list', path, data.get('limit')), lambda: list_s3_objects(path, limit=data.get('limit')))
+        elif command in jobs:
+            fn = jobs[command] if command == 'download' else modify_s3(jobs[command])
+            job = api_jobs.submit(command, path, fn, options)
+            if data.get('background'):
+                response = job['id']
+            else:
+                try:
+                    response = job['future'].result()
+                except Exception as e:
+                    response = f"Error: {e}"
+        elif command == 'status':
+            response = api_jobs.status(data.get('job'))
         elif command == 'shutdown':
             response = "Byebye"
         elif command == 'alive':  # Keep alive
@@ -611,26 +3267,29 @@ class RequestHandler(SimpleHTTPRequestHandler):
         
         # Send response
         try:
+            body = json.dumps({"message": response}).encode('utf-8')
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            
-            response = json.dumps({"message": response})
-            self.wfile.write(response.encode('utf-8'))
+            self.wfile.write(body)
         finally:
             if command == 'shutdown':
+                self.wfile.flush()  # Buffered, see wbufsize
                 os._exit(0)
 
 
-def run(server_class=TimedHTTPServer, handler_class=RequestHandler, port=API_SERVER_PORT, initial_timeout=600, idle_timeout=30):
+def run(server_class=TimedHTTPServer, handler_class=RequestHandler, port=API_SERVER_PORT, initial_timeout=600, idle_timeout=30, socket_path=None):
     server_address = ('', port)
+    if socket_path:
+        server_class, server_address = UnixHTTPServer, socket_path
     try:
         httpd = server_class(server_address, handler_class, initial_timeout, idle_timeout)
-        logger.info(f"Server started at localhost:{port}")
+        logger.info(f"Server started at {socket_path or f'localhost:{port}'}")
         httpd.serve_forever()
     except OSError as e:
         if e.errno == 98:
-            logger.error(f"Port {port} is already in use. Probably the server is already running?")
+            logger.error(f"{socket_path or f'Port {port}'} is already in use. Probably the server is already running?")
     finally:
         if 'httpd' in locals():
             httpd.shutdown_timer.cancel()
@@ -639,6 +3298,26 @@ def run(server_class=TimedHTTPServer, handler_class=RequestHandler, port=API_SER
             
 def shutdown_server():
     send_request("shutdown", "")
+
+
+def get_job_status(job_id):
+    """
+    Status of a job submitted with send_request(..., background=True).
+    """
+    return send_request("status", "", job=job_id)['message']
+
+
+def wait_for_job(job_id, interval=1):
+    """
+    Poll a background job until it finishes and return its result.
+    """
+    while True:
+        status = get_job_status(job_id)
+        if status['status'] == 'done':
+            return status['result']
+        if status['status'] in ('failed', 'unknown'):
+            raise RuntimeError(f"Job {job_id} {status['status']}: {status.get('error', '')}")
+        time.sleep(interval)
     
     
 def keep_alive(interval=5, stop_event=None):
@@ -676,15 +3355,36 @@ if __name__ == "__main__":
     )
     parser.add_argument("--remove", help="Remove S3 files", action="store_true")
     parser.add_argument("--delete", help="Delete local files", action="store_true")
+    parser.add_argument("--dry_run", help="With --delete, only print the number of files and bytes that would be deleted", action="store_true")
+    parser.add_argument("--sync", help="Sync local files and S3 files, only transferring changes", action="store_true")
+    parser.add_argument("--direction", choices=["download", "upload", "both"], default="download", help="Sync direction")
+    parser.add_argument("--delete_extra", help="Delete files missing on the source side when syncing", action="store_true")
     parser.add_argument("--interactive", help="Interactive mode", action="store_true")
     parser.add_argument("--local_path", help="Local path", type=str, default="./")
     parser.add_argument("--monitor", help="Monitor local path for changes", action="store_true")
     parser.add_argument("--server", help="Run as a S3 API server", action="store_true")
     parser.add_argument("--port", type=int, default=API_SERVER_PORT, help="Port for the HTTP server")
+    parser.add_argument("--socket", type=str, default=API_SERVER_SOCKET, help="Unix socket for the HTTP server instead of the port (default: $API_SERVER_SOCKET)")
     parser.add_argument("--interval", type=int, default=5, help="Polling interval in seconds.")
+    parser.add_argument("--watcher", choices=["auto", "inotify", "polling"], default="auto", help="How monitor detects changes")
+    parser.add_argument("--queue_workers", type=int, default=4, help="Number of uploads / removals monitor runs concurrently")
+    parser.add_argument("--queue_size", type=int, default=10000, help="Maximum number of operations queued by monitor")
+    parser.add_argument("--ignore", nargs='*', help="Glob patterns monitor never uploads, default to temporary files")
+    parser.add_argument("--keep_last", action="append", help="Keep the N latest files matching GLOB in S3, as GLOB=N")
+    parser.add_argument("--keep_best", action="append", help="Keep the N best files by a metric in the filename, as GLOB=METRIC:N[:min|max]")
+    parser.add_argument("--debounce", type=float, default=1.0, help="Seconds without writes before monitor uploads a closed file")
     parser.add_argument("--api", type=str, help="Use the API server for S3 operations", default="false")
     parser.add_argument("--initial_timeout", type=int, default=600, help="Initial timeout in seconds, if running in server mode")
     parser.add_argument("--idle_timeout", type=int, default=30, help="Idle timeout in seconds, if running in server mode")
+    parser.add_argument("--changed", choices=["mtime", "md5"], help="Re-upload files that changed, compared by mtime or MD5")
+    parser.add_argument("--verify", action="store_true", help="Check the size and ETag of transferred files and retry the ones that differ")
+    parser.add_argument("--workers", type=int, default=S3_MAX_WORKERS, help="Number of files transferred concurrently")
+    parser.add_argument("--concurrency", type=int, default=S3_MAX_CONCURRENCY, help="Number of parts transferred concurrently per file")
+    parser.add_argument("--numworkers", type=int, default=S5CMD_NUMWORKERS, help="Size of the s5cmd worker pool")
+    parser.add_argument("--chunksize", type=int, default=S3_MULTIPART_CHUNKSIZE // (1024 * 1024), help="Multipart chunk size in MB")
+    parser.add_argument("--limit", type=int, help="Maximum number of S3 objects to find or list")
+    parser.add_argument("--no_cache", help="Bypass the local S3 listing cache", action="store_true")
+    parser.add_argument("--benchmark", choices=["diff", "local"], help="Run a microbenchmark")
     parser.add_argument("path", help="The S3 or local path pattern", type=str, nargs='?')
 
     args = parser.parse_args()
@@ -698,31 +3398,51 @@ if __name__ == "__main__":
         args.api = True
     else:
         args.api = False
-    if not args.server and not args.path:
+    if not args.server and not args.benchmark and not args.path:
         parser.error("the following arguments are required: path")
-    if args.server:
-        run(port=args.port, initial_timeout=args.initial_timeout, idle_timeout=args.idle_timeout)
+    if (args.workers, args.concurrency, args.chunksize * 1024 * 1024) != (S3_MAX_WORKERS, S3_MAX_CONCURRENCY, S3_MULTIPART_CHUNKSIZE):
+        S3_MAX_WORKERS = args.workers
+        S3_MAX_CONCURRENCY = args.concurrency
+        S3_MULTIPART_CHUNKSIZE = args.chunksize * 1024 * 1024
+        reset_s3_client()  # Resize the connection pool
+    S5CMD_NUMWORKERS = args.numworkers
+    if args.no_cache:
+        listing_cache.ttl = 0
+    if args.benchmark == "diff":
+        benchmark_diff_trees()
+    elif args.benchmark == "local":
+        benchmark_get_local_files()
+    elif args.server:
+        run(port=args.port, initial_timeout=args.initial_timeout, idle_timeout=args.idle_timeout, socket_path=args.socket)
     elif args.monitor:
-        monitor(args.path, args.interval)
+        monitor(
+            args.path, args.interval, backend=args.watcher, debounce=args.debounce,
+            workers=args.queue_workers, queue_size=args.queue_size,
+            retention=RetentionPolicy.from_args(args.ignore, args.keep_last, args.keep_best)
+        )
     elif args.find:
         file_type = "folders" if s3_path.endswith("/") else "files"
-        s3_objects = get_s3_objects(s3_path + "**" if file_type == "folders" else s3_path)
+        s3_objects = get_s3_objects(s3_path + "**" if file_type == "folders" else s3_path, limit=args.limit)
         if file_type == "folders":
             print_folders(s3_objects)
         else:
             for obj in s3_objects:
                 logger.info(obj)
     elif args.list:
-        rtn = list_s3_objects(s3_path)
+        rtn = list_s3_objects(s3_path, limit=args.limit)
     elif args.download:
-        rtn = download_s3_path(s3_path, local_path, api_call=args.api)
+        rtn = download_s3_path(s3_path, local_path, api_call=args.api, verify=args.verify)
     elif args.upload:
-        rtn = upload_s3_path(s3_path, local_path, api_call=args.api)
+        rtn = upload_s3_path(s3_path, local_path, api_call=args.api, changed=args.changed, verify=args.verify)
     elif args.remove:
         rtn = remove_s3_path(s3_path, api_call=args.api)
+    elif args.sync:
+        rtn = sync_s3_path(
+            s3_path, local_path, direction=args.direction, delete=args.delete_extra, api_call=args.api, verify=args.verify
+        )
     elif args.delete:
         local_files = get_local_files(s3_path, local_path)
-        rtn = delete_local_files(local_files)
+        delete_local_files(local_files, root=local_path, dry_run=args.dry_run)
     elif args.interactive:
         rtn = interactive_list_and_action(s3_path, local_path)
     else: